@@ -0,0 +1,330 @@
+#!/usr/bin/python3
+"""
+Batch identification over stored frames or a whole template store.
+
+With inputs (recordings from debug_sensor.py --record, PNGs or directories of
+PNGs) every frame is identified against the store exactly like a live verify
+and a per-frame decision is written. Without inputs the store is matched
+against itself: every template is a probe (its own descriptors excluded),
+giving a finger x finger score matrix and a list of cross-user pairs that
+look like the same finger enrolled twice.
+
+SIFT runs in a process pool, knnMatch is issued for many probes at once and
+the geometric checks are spread over threads (OpenCV releases the GIL).
+
+    python3 batch_match.py /var/lib/open-fprintd/egis capture.rec pngs/ --csv decisions.csv
+    python3 batch_match.py /var/lib/open-fprintd/egis --matrix scores.csv
+"""
+import argparse
+import csv
+import multiprocessing as mp
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from egis_driver import fingerprint_matcher, recorder
+from egis_driver.background import BackgroundModel
+from egis_driver.compact import DESCRIPTOR_MODES
+from egis_driver.correction import FrameCorrector
+from egis_driver.geometry import ESTIMATORS, GEOMETRY_MODELS, GeometricVerifier
+from egis_driver.quality import frame_quality
+from egis_driver.signature import SHORTLIST, SHORTLIST_KNN
+
+FRAME_SHAPE = (50, 103)
+# Probes per knnMatch call
+BATCH_SIZE = 256
+
+# ------------------ Inputs --------------------------
+
+def load_frames(paths, all_frames=False):
+    """[(source, index, expected finger or '', (50, 103) uint8)] from recordings / PNGs / directories"""
+    frames = []
+    for path in paths:
+        if os.path.isdir(path):
+            frames += load_frames(sorted(os.path.join(path, n) for n in os.listdir(path)
+                                         if n.lower().endswith(".png")), all_frames)
+            continue
+        try:
+            records = recorder.open_recording(path)
+        except ValueError:
+            records = None
+
+        if records is not None:
+            for i, rec in enumerate(records):
+                if not all_frames and not rec["touched"]: continue
+                user, finger = rec["user"].decode(), rec["finger"].decode()
+                expected = f"{user}_{finger}" if user and finger else ""
+                frames.append((path, i, expected, np.array(rec["frame"])))
+            continue
+
+        img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if img is None or img.shape != FRAME_SHAPE:
+            print(f"Skipping {path}: not a recording or a {FRAME_SHAPE[1]}x{FRAME_SHAPE[0]} image")
+            continue
+        frames.append((path, 0, "", img))
+    return frames
+
+def load_corrector(path):
+    if not path or not os.path.exists(path): return None
+    background = BackgroundModel(FRAME_SHAPE, path=path)
+    if not background.calibrated: return None
+    corrector = FrameCorrector(FRAME_SHAPE)
+    corrector.build(background.mean, background.var)
+    return corrector
+
+# ------------------ Feature extraction (worker processes) --------------------------
+
+_worker = None
+
+def _init_worker(corrector, min_quality):
+    global _worker
+    cv2.setNumThreads(1)
+    _worker = (cv2.SIFT_create(), corrector, min_quality)
+
+def _extract(img_arr):
+    """Same gate + SIFT as FingerprintMatcher.verify_finger. Returns (quality, points, des) / (quality, None, None)"""
+    sift, corrector, min_quality = _worker
+    quality = frame_quality(img_arr)["score"]
+    if min_quality is not None and quality < min_quality:
+        return quality, None, None
+    kp, des = sift.detectAndCompute(fingerprint_matcher.preprocess(img_arr, corrector), None)
+    if des is None or len(kp) < 4:
+        return quality, None, None
+    return quality, cv2.KeyPoint_convert(kp), des
+
+def extract_all(images, corrector, min_quality, jobs):
+    if jobs <= 1:
+        _init_worker(corrector, min_quality)
+        return [_extract(img) for img in images]
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(jobs, initializer=_init_worker, initargs=(corrector, min_quality)) as pool:
+        return pool.map(_extract, images, chunksize=max(1, len(images) // (jobs * 8)))
+
+# ------------------ Matching --------------------------
+
+def batched_matches(matcher, probes, exclude=None):
+    """
+    probes: list of (N_i, D) query descriptors (index view) or None.
+    Yields (probe, query_idx, train_idx, distances) with ratio-tested global matches.
+    exclude: optional (start, end) global range per probe whose hits are ignored
+    (the probe's own template when the store is matched against itself).
+    With the VLAD shortlist on, the knn still goes out per batch; only picking
+    the shortlist and its ratio test are per probe, as in _candidate_matches.
+    """
+    snap = matcher.snapshot
+    for first in range(0, len(probes), BATCH_SIZE):
+        chunk = [(i, probes[i]) for i in range(first, min(first + BATCH_SIZE, len(probes))) if probes[i] is not None]
+        if not chunk: continue
+        # None for every probe when all fingers fit in the shortlist
+        shortlists = [None] * len(chunk) if exclude is not None else \
+            [matcher.shortlisted_templates(d, snap) for _, d in chunk]
+        shortlisted = shortlists[0] is not None
+
+        k = SHORTLIST_KNN if shortlisted else 2 if exclude is None else 3
+        offsets = np.cumsum([0] + [len(d) for _, d in chunk])
+        # One row per query descriptor, in order
+        train, dist = snap.knn_arrays(np.vstack([d for _, d in chunk]), k=k)
+
+        if shortlisted:
+            for o, (i, _) in enumerate(chunk):
+                rows = slice(offsets[o], offsets[o + 1])
+                yield (i,) + matcher._shortlist_filter(train[rows], dist[rows], shortlists[o], snap)
+            continue
+
+        query = np.arange(len(train))
+        owner = np.searchsorted(offsets, query, side="right") - 1
+        if exclude is not None:
+            start = np.array([exclude[chunk[o][0]][0] for o in range(len(chunk))])[owner]
+            end = np.array([exclude[chunk[o][0]][1] for o in range(len(chunk))])[owner]
+            own = (train >= start[:, None]) & (train < end[:, None]) | (train < 0)
+            # Move the probe's own hits to the back, keep the two best others
+            order = np.argsort(own, axis=1, kind="stable")
+            train = np.take_along_axis(train, order, axis=1)
+            dist = np.where(np.take_along_axis(own, order, axis=1), np.inf, np.take_along_axis(dist, order, axis=1))
+
+        keep = (train[:, 0] >= 0) & np.isfinite(dist[:, 1]) & (dist[:, 0] < fingerprint_matcher.RATIO_TEST * dist[:, 1])
+        for o, (i, _) in enumerate(chunk):
+            sel = keep & (owner == o)
+            yield i, query[sel] - offsets[o], train[sel, 0], dist[sel, 0]
+
+def score_probes(matcher, points, probes, jobs, exclude=None, top=1):
+    """[(template, votes, inliers)] per probe; geometric checks run on a thread pool"""
+    scores = [[] for _ in probes]
+    with ThreadPoolExecutor(max(1, jobs)) as pool:
+        futures = {}
+        for i, q, t, d in batched_matches(matcher, probes, exclude):
+            futures[i] = pool.submit(matcher.template_scores, points[i], q, t, d, top)
+        for i, f in futures.items():
+            scores[i] = f.result()
+    return scores
+
+def finger_of(matcher, template):
+    return matcher.template_keys[template][0].replace(".npy", "")
+
+def user_of(finger):
+    # Files are <username>_<finger-name>; finger names use '-' only
+    return finger.rsplit("_", 1)[0]
+
+# ------------------ Modes --------------------------
+
+def run_frames(matcher, args, corrector):
+    frames = load_frames(args.inputs, args.all_frames)
+    if not frames:
+        print("No frames found.")
+        return 1
+
+    t0 = time.perf_counter()
+    min_quality = None if args.no_quality else matcher.min_quality
+    features = extract_all([f[3] for f in frames], corrector, min_quality, args.jobs)
+    t1 = time.perf_counter()
+
+    probes = [None if des is None else matcher._index_view(des) for _, _, des in features]
+    points = [pts for _, pts, _ in features]
+    scores = score_probes(matcher, points, probes, args.jobs, top=None if args.matrix else 1)
+    t2 = time.perf_counter()
+
+    fingers = sorted({f.replace(".npy", "") for f, _ in matcher.template_keys})
+    column = {f: c for c, f in enumerate(fingers)}
+    matrix = np.zeros((len(frames), len(fingers)), dtype=np.int32)
+
+    rows = []
+    tally = {"match": 0, "no-match": 0, "unusable": 0, "correct": 0, "false-accept": 0, "false-reject": 0}
+    for i, ((source, index, expected, _), (quality, _, des), probe_scores) in enumerate(zip(frames, features, scores)):
+        for t, _, inliers in probe_scores:
+            c = column[finger_of(matcher, t)]
+            matrix[i, c] = max(matrix[i, c], inliers)
+
+        best, score = "", 0
+        if probe_scores:
+            # Live verify only checks the most voted template
+            t, _, score = probe_scores[0]
+            best = finger_of(matcher, t)
+
+        if des is None: decision = "unusable"
+        elif score >= matcher.geometry.min_inliers and score >= args.threshold: decision = "match"
+        else: decision = "no-match"
+        tally[decision] += 1
+        if expected:
+            if decision == "match":
+                tally["correct" if best == expected else "false-accept"] += 1
+            elif decision == "no-match" and expected in column:
+                tally["false-reject"] += 1
+        rows.append((source, index, expected, f"{quality:.3f}", best, score, decision))
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["source", "index", "expected", "quality", "best", "score", "decision"])
+            w.writerows(rows)
+    else:
+        for row in rows:
+            print("%s[%d] expected=%s quality=%s best=%s score=%d %s" % row)
+
+    if args.matrix:
+        write_matrix(args.matrix, [f"{s}[{i}]" for s, i, _, _ in frames], fingers, matrix)
+
+    print(f"\n{len(frames)} frames: SIFT {t1 - t0:.2f}s, match {t2 - t1:.2f}s "
+          f"({len(frames) / max(t2 - t0, 1e-9):.0f} frames/s, {args.jobs} jobs)")
+    print("  " + "  ".join(f"{k}={v}" for k, v in tally.items()))
+    return 0
+
+def run_store(matcher, args):
+    """Every template against the rest of the store"""
+    bounds = matcher.template_offsets
+    n = len(matcher.template_keys)
+    probes = [matcher._index_view(matcher.train_descriptors[bounds[t]:bounds[t + 1]]) for t in range(n)]
+    points = [matcher.train_points[bounds[t]:bounds[t + 1]] for t in range(n)]
+    exclude = [(bounds[t], bounds[t + 1]) for t in range(n)]
+
+    t0 = time.perf_counter()
+    scores = score_probes(matcher, points, probes, args.jobs, exclude, top=None)
+    elapsed = time.perf_counter() - t0
+    comparisons = sum(len(s) for s in scores)
+
+    fingers = sorted({f.replace(".npy", "") for f, _ in matcher.template_keys})
+    column = {f: c for c, f in enumerate(fingers)}
+    matrix = np.zeros((len(fingers), len(fingers)), dtype=np.int32)
+    genuine, impostor = [], []
+    for t, probe_scores in enumerate(scores):
+        r = column[finger_of(matcher, t)]
+        for other, _, inliers in probe_scores:
+            c = column[finger_of(matcher, other)]
+            matrix[r, c] = max(matrix[r, c], inliers)
+            (genuine if r == c else impostor).append(inliers)
+
+    if args.matrix:
+        write_matrix(args.matrix, fingers, fingers, matrix)
+    elif len(fingers) <= 20:
+        width = max(len(f) for f in fingers)
+        for f, row in zip(fingers, matrix):
+            print(f"{f:<{width}} " + " ".join(f"{v:4d}" for v in row))
+
+    print(f"\n{n} templates, {len(fingers)} fingers: {comparisons} geometric checks in {elapsed:.2f}s ({args.jobs} jobs)")
+    for name, values in (("same finger", genuine), ("other fingers", impostor)):
+        if values:
+            p = np.percentile(values, [5, 50, 95])
+            print(f"  {name:<14} n={len(values):<6} p5={p[0]:.0f} p50={p[1]:.0f} p95={p[2]:.0f} max={max(values)}")
+
+    symmetric = np.maximum(matrix, matrix.T)
+    duplicates = [(fingers[r], fingers[c], int(symmetric[r, c]))
+                  for r in range(len(fingers)) for c in range(r + 1, len(fingers))
+                  if symmetric[r, c] >= args.threshold and user_of(fingers[r]) != user_of(fingers[c])]
+    for a, b, score in duplicates:
+        print(f"  !! {a} and {b} look like the same finger (score {score})")
+    return 1 if duplicates else 0
+
+def write_matrix(path, rows, columns, matrix):
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow([""] + columns)
+        for label, values in zip(rows, matrix):
+            w.writerow([label] + values.tolist())
+    print(f"Score matrix written to {path}")
+
+def main():
+    parser = argparse.ArgumentParser("Batch fingerprint identification")
+    parser.add_argument("enroll_dir", help="Template store")
+    parser.add_argument("inputs", nargs="*", help="Recordings, PNGs or PNG directories (none = match the store against itself)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Worker processes / threads")
+    parser.add_argument("--threshold", type=int, help="Inliers needed to accept (default: the geometry model's, like the bridge)")
+    parser.add_argument("--geometry", choices=GEOMETRY_MODELS, default="similarity", help="Geometric check model")
+    parser.add_argument("--estimator", choices=ESTIMATORS, default="ransac", help="Geometric check estimator")
+    parser.add_argument("--csv", help="Write per-frame decisions here instead of printing them")
+    parser.add_argument("--matrix", help="Write the full score matrix (CSV) here")
+    parser.add_argument("--calibration", help="Background model for frame correction (default: <store>/background.npz)")
+    parser.add_argument("--descriptor-mode", choices=DESCRIPTOR_MODES, default="uint8")
+    parser.add_argument("--shortlist", type=int, default=SHORTLIST,
+                        help=f"Fingers kept by the VLAD prefilter in frames mode (default {SHORTLIST} like the "
+                             "live matcher, 0 = all of them)")
+    parser.add_argument("--no-quality", action="store_true", help="Don't reject low quality frames")
+    parser.add_argument("--all-frames", action="store_true", help="Include idle (untouched) recorded frames")
+    args = parser.parse_args()
+    # FingerprintMatcher would create a mistyped store as an empty one
+    if not os.path.isdir(args.enroll_dir):
+        parser.error(f"no template store at {args.enroll_dir}")
+    missing = [p for p in args.inputs if not os.path.exists(p)]
+    if missing:
+        parser.error(f"no such file or directory: {', '.join(missing)}")
+
+    corrector = load_corrector(args.calibration or os.path.join(args.enroll_dir, "background.npz"))
+    # Store mode always searches the whole index
+    shortlist = args.shortlist if args.inputs else 0
+    matcher = fingerprint_matcher.FingerprintMatcher(enroll_dir=args.enroll_dir, corrector=corrector,
+                                                     descriptor_mode=args.descriptor_mode, shortlist=shortlist,
+                                                     geometry=GeometricVerifier(args.geometry, args.estimator))
+    if matcher.train_descriptors is None:
+        print("No templates found.")
+        return 1
+    if args.threshold is None:
+        args.threshold = matcher.geometry.min_inliers
+
+    if args.inputs:
+        return run_frames(matcher, args, corrector)
+    return run_store(matcher, args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+"""
+Descriptor representation benchmark: float32 vs uint8 vs PCA.
+
+For every mode it builds the matcher's index over a template store and
+reports memory, index build time, knnMatch latency and leave-one-template-out
+identification accuracy (each stored template is used as a probe and must
+vote for its own finger file, ignoring its own descriptors).
+
+Every mode gets a second "+sl" row for the verify path with the VLAD finger
+shortlist: its build includes the signatures, its latency the signature,
+the knn and the shortlist ratio test. The plain rows search the whole index.
+
+    python3 bench_descriptors.py /var/lib/open-fprintd/egis
+    python3 bench_descriptors.py --synthetic 40
+    python3 bench_descriptors.py --synthetic 40 --shortlist 0
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from egis_driver import fingerprint_matcher
+from egis_driver.compact import DESCRIPTOR_MODES, PCA_DIMS
+from egis_driver.signature import SHORTLIST, SHORTLIST_KNN
+
+def make_synthetic_store(path, fingers, scans=6, seed=0):
+    """Fake fingers: smooth random ridge fields, scanned as shifted/rotated noisy 50x103 crops."""
+    rng = np.random.default_rng(seed)
+    matcher = fingerprint_matcher.FingerprintMatcher(enroll_dir=path)
+    y, x = np.mgrid[0:120, 0:180].astype(np.float32)
+    for f in range(fingers):
+        field = cv2.GaussianBlur(rng.normal(0, 1, (120, 180)).astype(np.float32), (0, 0), 12)
+        theta = field / (np.abs(field).max() + 1e-6) * np.pi
+        phase = (x * np.cos(theta) + y * np.sin(theta)) * 2 * np.pi / rng.uniform(6, 9)
+        finger = (128 + 60 * np.sin(phase + 4 * field)).astype(np.float32)
+
+        frames = []
+        for _ in range(scans):
+            rot = cv2.getRotationMatrix2D((90, 60), rng.uniform(-15, 15), 1.0)
+            warped = cv2.warpAffine(finger, rot, (180, 120), borderMode=cv2.BORDER_REFLECT)
+            oy, ox = rng.integers(10, 60), rng.integers(10, 67)
+            crop = warped[oy:oy + 50, ox:ox + 103] + rng.normal(0, 6, (50, 103))
+            frames.append(np.clip(crop, 0, 255).astype(np.uint8).tobytes())
+        matcher.enroll_finger(f"user{f}_finger", frames)
+
+def knn_owners(matcher, des, start, end):
+    """Templates voted for by a plain knn over the whole index, the probe's own descriptors [start, end) left out"""
+    owners = []
+    for row in matcher._knn_match(des, k=4):
+        # Drop the probe's own descriptors, then apply the usual ratio test
+        row = [m for m in row if not start <= m.trainIdx < end]
+        if len(row) < 2 or row[0].distance >= 0.85 * row[1].distance: continue
+        owners.append(np.searchsorted(matcher.template_offsets, row[0].trainIdx, side="right") - 1)
+    return owners
+
+def shortlist_owners(matcher, des, own):
+    """Templates voted for through the finger shortlist, like a verify, with template `own` left out"""
+    snap = matcher.snapshot
+    allowed = matcher.shortlisted_templates(des, snap, exclude=own)
+    if allowed is None: allowed = np.ones(len(snap.template_keys), dtype=bool)
+    allowed[own] = False
+    # One more neighbour than a verify: the probe's own descriptor comes first
+    idx, dist = snap.knn_arrays(des, k=SHORTLIST_KNN + 1)
+    _, train_idx, _ = matcher._shortlist_filter(idx, dist, allowed, snap)
+    return np.searchsorted(snap.template_offsets, train_idx, side="right") - 1
+
+def evaluate(matcher, shortlist=False):
+    """
+    Leave-one-template-out identification over the loaded store.
+    shortlist: go through the VLAD finger shortlist instead of a plain knn.
+    """
+    starts = matcher.template_offsets[:-1]
+    ends = matcher.template_offsets[1:]
+    files = [filename for filename, _ in matcher.template_keys]
+
+    correct = total = 0
+    knn_time = 0.0
+    for i, filename in enumerate(files):
+        # Only fingers with more than one template can be identified
+        if files.count(filename) < 2: continue
+        probe = matcher.train_descriptors[starts[i]:ends[i]]
+
+        t0 = time.perf_counter()
+        if shortlist:
+            owners = shortlist_owners(matcher, matcher._index_view(probe), i)
+        else:
+            owners = knn_owners(matcher, matcher._index_view(probe), starts[i], ends[i])
+        knn_time += time.perf_counter() - t0
+
+        votes = {}
+        for owner in owners:
+            votes[files[owner]] = votes.get(files[owner], 0) + 1
+
+        total += 1
+        if votes and max(votes, key=votes.get) == filename:
+            correct += 1
+
+    return correct, total, knn_time
+
+def main():
+    parser = argparse.ArgumentParser("Descriptor representation benchmark")
+    parser.add_argument("enroll_dir", nargs="?", help="Template store to benchmark")
+    parser.add_argument("--synthetic", type=int, metavar="FINGERS",
+                        help="Benchmark a generated store with this many fingers instead")
+    parser.add_argument("--pca-dims", type=int, default=PCA_DIMS)
+    parser.add_argument("--shortlist", type=int, default=SHORTLIST,
+                        help=f"Fingers kept by the VLAD prefilter in the +sl rows (default {SHORTLIST}, 0 = no +sl rows)")
+    args = parser.parse_args()
+
+    tmp_dir = None
+    if args.synthetic:
+        tmp_dir = tempfile.mkdtemp(prefix="egis_bench_")
+        make_synthetic_store(tmp_dir, args.synthetic)
+        enroll_dir = tmp_dir
+    elif args.enroll_dir:
+        enroll_dir = args.enroll_dir
+    else:
+        parser.error("Give a template store or --synthetic N")
+
+    try:
+        results = []
+        runs = [(mode, 0) for mode in DESCRIPTOR_MODES]
+        if args.shortlist > 0:
+            runs += [(mode, args.shortlist) for mode in DESCRIPTOR_MODES]
+        for mode, shortlist in runs:
+            # shortlist=0: build is the tree alone, knn the whole index
+            t0 = time.perf_counter()
+            matcher = fingerprint_matcher.FingerprintMatcher(enroll_dir=enroll_dir, descriptor_mode=mode,
+                                                             pca_dims=args.pca_dims, shortlist=shortlist)
+            build_time = time.perf_counter() - t0
+            if matcher.train_descriptors is None:
+                print("No templates found.")
+                sys.exit(1)
+
+            # Descriptor pile + keypoint positions + what FLANN is handed
+            pile = matcher.train_descriptors.nbytes
+            points = matcher.train_points.nbytes
+            index = matcher._index_view(matcher.train_descriptors[:1]).shape[1] * 4 * len(matcher.train_descriptors)
+
+            correct, total, knn_time = evaluate(matcher, shortlist=shortlist > 0)
+            label = f"{mode}+sl" if shortlist else mode
+            results.append((label, pile, points, index, build_time, knn_time / max(total, 1), correct, total))
+
+        print(f"\n{'mode':<9} {'pile':>9} {'points':>9} {'index':>9} {'build':>8} {'knn/probe':>10} {'accuracy':>10}")
+        for mode, pile, points, index, build_time, knn, correct, total in results:
+            print(f"{mode:<9} {pile/1024:>8.0f}K {points/1024:>8.0f}K {index/1024:>8.0f}K "
+                  f"{build_time:>7.2f}s {knn*1000:>8.2f}ms {correct:>4}/{total:<5}")
+    finally:
+        if tmp_dir: shutil.rmtree(tmp_dir)
+
+if __name__ == "__main__":
+    main()
@@ -4,17 +4,15 @@ import numpy as np
 import time
 import os
 import sys
+import argparse
 
 # Import your existing driver
 from egis_driver import egis_driver
+from egis_driver import recorder
 
 SAVE_DIR = "/tmp/egis_debug"
 
-def main():
-    if not os.path.exists(SAVE_DIR):
-        os.makedirs(SAVE_DIR)
-        print(f"Created debug directory: {SAVE_DIR}")
-
+def init_driver():
     print("Initializing Driver...")
     try:
         driver = egis_driver.EgisDriver()
@@ -23,6 +21,72 @@ def main():
         print(f"Failed to init sensor: {e}")
         print("Did you forget to stop the egis-bridge service?")
         sys.exit(1)
+    return driver
+
+def record(path, user, finger, max_frames):
+    """Streams EVERY frame (idle included) into a recording at full sensor rate"""
+    driver = init_driver()
+    rec = recorder.FrameRecorder(path, egis_driver.IMG_HEIGHT, egis_driver.IMG_WIDTH, user=user, finger=finger)
+
+    print(f"\n=== RECORDING to {path} ({rec.count} frames already) ===")
+    print("Press Ctrl+C to stop.\n")
+
+    touch_id = -1
+    next_touch = 0
+    was_touched = False
+    start = time.time()
+    recorded = 0
+    try:
+        while not max_frames or recorded < max_frames:
+            t0 = time.time()
+            img_raw, contrast = driver.get_live_frame()
+            usb_time = time.time() - t0
+            if img_raw is None:
+                continue
+
+            touched = driver.is_finger_present(img_raw, contrast)
+            if touched and not was_touched:
+                touch_id = next_touch
+                next_touch += 1
+            was_touched = touched
+
+            rec.append(img_raw, contrast, usb_time, touched, touch_id if touched else -1, timestamp=t0)
+            recorded += 1
+
+            if recorded % 50 == 0:
+                rate = recorded / (time.time() - start)
+                sys.stdout.write(f"\rFrames: {recorded}  Touches: {next_touch}  Rate: {rate:.1f} fps   ")
+                sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        rec.close()
+    print(f"\nRecorded {recorded} frames ({next_touch} touches) to {path}")
+
+def main():
+    parser = argparse.ArgumentParser("Egis sensor debug tool")
+    parser.add_argument("--record", metavar="FILE", help="Stream raw frames into a recording instead of PNGs")
+    parser.add_argument("--user", default="", help="Label stored with recorded frames")
+    parser.add_argument("--finger", default="", help="Label stored with recorded frames")
+    parser.add_argument("--frames", type=int, default=0, help="Stop recording after N frames (0 = until Ctrl+C)")
+    parser.add_argument("--export", metavar="FILE", help="Export a recording to PNGs in --out")
+    parser.add_argument("--out", default=SAVE_DIR, help="PNG output directory")
+    parser.add_argument("--touched-only", action="store_true", help="Export only frames with a finger present")
+    args = parser.parse_args()
+
+    if args.export:
+        n = recorder.export_png(args.export, args.out, touched_only=args.touched_only)
+        print(f"Exported {n} frames to {args.out}")
+        return
+    if args.record:
+        record(args.record, args.user, args.finger, args.frames)
+        return
+
+    if not os.path.exists(SAVE_DIR):
+        os.makedirs(SAVE_DIR)
+        print(f"Created debug directory: {SAVE_DIR}")
+
+    driver = init_driver()
 
     print("\n=== SENSOR DEBUG MODE ===")
     print(f"Saving images to: {SAVE_DIR}")
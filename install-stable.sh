@@ -23,6 +23,7 @@ sudo mkdir -p "$INSTALL_DIR/enrolled_prints"
 echo "[*] Copying executables..."
 sudo cp "$SOURCE_DIR/bin/open-fprintd" "$INSTALL_DIR/"
 sudo cp "$SOURCE_DIR/bin/egis-bridge" "$INSTALL_DIR/"
+sudo cp "$SOURCE_DIR/bin/fprint-trace" "$INSTALL_DIR/"
 
 # 4. Copy Libraries (The Packages)
 echo "[*] Copying libraries..."
@@ -92,6 +93,7 @@ EOF
 echo "[*] Setting permissions..."
 sudo chmod +x "$INSTALL_DIR/open-fprintd"
 sudo chmod +x "$INSTALL_DIR/egis-bridge"
+sudo chmod +x "$INSTALL_DIR/fprint-trace"
 sudo chmod 700 "$INSTALL_DIR/enrolled_prints"
 
 echo "[*] reloading udev and systemd..."
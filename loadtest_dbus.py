@@ -0,0 +1,521 @@
+#!/usr/bin/python3
+"""
+D-Bus load / concurrency harness for open-fprintd.
+
+Starts a private dbus-daemon, points open-fprintd at it (as its "system bus")
+and replaces everything behind it with stand-ins: a fake bridge implementing
+io.github.uunicorn.Fprint.Device with configurable latencies, and a fake
+org.freedesktop.PolicyKit1 authority. Many simulated clients, each on its
+own connection like separate PAM / fprintd-verify processes, then hammer
+the daemon:
+
+    claim    - every client Claims the device at once, winner Releases
+    list     - parallel ListEnrolledFingers
+    verify   - VerifyStart / VerifyStop storms on the claimed device while
+               the other clients race unclaimed VerifyStarts
+    suspend  - Suspend, queue ListEnrolledFingers behind it, Resume
+
+For each scenario it reports throughput and p50 / p95 / p99 latency per call,
+and what was left behind once the clients disconnected: daemon threads,
+file descriptors and bus match rules (watch_name_owner watchers), plus
+scans the bridge was never told to stop.
+
+    python3 loadtest_dbus.py --clients 32 --rounds 20
+    python3 loadtest_dbus.py --scenario verify --match-latency 300 --polkit-latency 20
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.join(HERE, "open-fprintd-eh575")
+DAEMON = os.path.join(PACKAGE_DIR, "bin", "open-fprintd")
+
+FPRINT_BUS = "net.reactivated.Fprint"
+MANAGER_OBJ = "/net/reactivated/Fprint/Manager"
+MANAGER_IFACE = "net.reactivated.Fprint.Manager"
+DEVICE_IFACE = "net.reactivated.Fprint.Device"
+BRIDGE_IFACE = "io.github.uunicorn.Fprint.Device"
+BRIDGE_OBJ = "/io/github/uunicorn/LoadTest/Bridge"
+POLKIT_BUS = "org.freedesktop.PolicyKit1"
+POLKIT_OBJ = "/org/freedesktop/PolicyKit1/Authority"
+POLKIT_IFACE = "org.freedesktop.PolicyKit1.Authority"
+STATS_BUS = "io.github.uunicorn.LoadTest"
+STATS_IFACE = "io.github.uunicorn.LoadTest"
+
+SCENARIOS = ("claim", "list", "verify", "suspend")
+CALL_TIMEOUT = 30.0   # seconds
+# Let deferred releases / name-owner callbacks run before counting leftovers
+SETTLE_TIME = 1.0
+
+BUS_CONFIG = """<!DOCTYPE busconfig PUBLIC "-//freedesktop//DTD D-BUS Bus Configuration 1.0//EN"
+ "http://www.freedesktop.org/standards/dbus/1.0/busconfig.dtd">
+<busconfig>
+  <type>session</type>
+  <listen>unix:dir={dir}</listen>
+  <auth>EXTERNAL</auth>
+  <policy context="default">
+    <allow send_destination="*" eavesdrop="true"/>
+    <allow eavesdrop="true"/>
+    <allow own="*"/>
+  </policy>
+</busconfig>
+"""
+
+# ------------------ Stand-ins (run as a child process) --------------------------
+
+def run_stand_ins(args):
+    """Fake bridge + fake polkit authority on the private bus. Never blocks the loop: latencies are timers."""
+    import dbus
+    import dbus.service
+    import dbus.mainloop.glib
+    from gi.repository import GLib
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    bus = dbus.bus.BusConnection(args.address)
+    stats = Counter()
+
+    def later(ms, fn):
+        def fire():
+            fn()
+            return False
+        return GLib.timeout_add(max(0, int(ms)), fire)
+
+    class FakePolkit(dbus.service.Object):
+        @dbus.service.method(POLKIT_IFACE, in_signature="(sa{sv})sa{ss}us", out_signature="(bba{ss})",
+                             async_callbacks=("reply", "error"))
+        def CheckAuthorization(self, subject, action_id, details, flags, cancel_id, reply, error):
+            stats["polkit"] += 1
+            allowed = random.random() >= args.polkit_deny
+            if not allowed: stats["polkit-denied"] += 1
+            result = dbus.Struct((allowed, False, dbus.Dictionary({}, signature="ss")), signature="bba{ss}")
+            later(args.polkit_latency, lambda: reply(result))
+
+    class FakeBridge(dbus.service.Object):
+        def __init__(self, conn, path):
+            dbus.service.Object.__init__(self, conn, path)
+            self.scan = None   # timer of the running verify/enroll
+
+        def _reply(self, name, reply, value=None):
+            stats[name] += 1
+            later(args.call_latency, (lambda: reply(value)) if value is not None else reply)
+
+        def _start(self, kind, signal):
+            if self.scan is not None: stats["overlapping-scans"] += 1
+            self._cancel()
+            stats["scans"] += 1
+            def done():
+                self.scan = None
+                stats["scans-completed"] += 1
+                signal(args.result if kind == "verify" else "enroll-completed", True)
+            self.scan = later(args.match_latency, done)
+
+        def _cancel(self):
+            if self.scan is not None:
+                GLib.source_remove(self.scan)
+                self.scan = None
+                stats["scans-cancelled"] += 1
+
+        @dbus.service.method(BRIDGE_IFACE, in_signature="s", out_signature="")
+        def SetTraceId(self, trace_id):
+            stats["SetTraceId"] += 1
+
+        @dbus.service.method(BRIDGE_IFACE, in_signature="ss", out_signature="", async_callbacks=("reply", "error"))
+        def VerifyStart(self, username, finger_name, reply, error):
+            self._start("verify", self.VerifyStatus)
+            self._reply("VerifyStart", reply)
+
+        @dbus.service.method(BRIDGE_IFACE, in_signature="ss", out_signature="", async_callbacks=("reply", "error"))
+        def EnrollStart(self, username, finger_name, reply, error):
+            self._start("enroll", self.EnrollStatus)
+            self._reply("EnrollStart", reply)
+
+        @dbus.service.method(BRIDGE_IFACE, in_signature="", out_signature="")
+        def VerifyStop(self):
+            stats["VerifyStop"] += 1
+            self._cancel()
+
+        @dbus.service.method(BRIDGE_IFACE, in_signature="", out_signature="")
+        def EnrollStop(self):
+            stats["EnrollStop"] += 1
+            self._cancel()
+
+        @dbus.service.method(BRIDGE_IFACE, in_signature="", out_signature="")
+        def Cancel(self):
+            stats["Cancel"] += 1
+            self._cancel()
+
+        @dbus.service.method(BRIDGE_IFACE, in_signature="s", out_signature="as", async_callbacks=("reply", "error"))
+        def ListEnrolledFingers(self, username, reply, error):
+            self._reply("ListEnrolledFingers", reply, dbus.Array(["right-index-finger"], signature="s"))
+
+        @dbus.service.method(BRIDGE_IFACE, in_signature="s", out_signature="", async_callbacks=("reply", "error"))
+        def DeleteEnrolledFingers(self, username, reply, error):
+            self._reply("DeleteEnrolledFingers", reply)
+
+        @dbus.service.method(BRIDGE_IFACE, in_signature="", out_signature="", async_callbacks=("reply", "error"))
+        def Suspend(self, reply, error):
+            self._reply("Suspend", reply)
+
+        @dbus.service.method(BRIDGE_IFACE, in_signature="", out_signature="", async_callbacks=("reply", "error"))
+        def Resume(self, reply, error):
+            self._reply("Resume", reply)
+
+        @dbus.service.method(BRIDGE_IFACE, in_signature="s", out_signature="s")
+        def RunCmd(self, cmd):
+            stats["RunCmd"] += 1
+            return cmd
+
+        @dbus.service.method(STATS_IFACE, in_signature="", out_signature="a{su}")
+        def Stats(self):
+            current = dict(stats)
+            current["active-scans"] = int(self.scan is not None)
+            return dbus.Dictionary(current, signature="su")
+
+        @dbus.service.method(STATS_IFACE, in_signature="", out_signature="")
+        def ResetStats(self):
+            stats.clear()
+
+        @dbus.service.signal(BRIDGE_IFACE, signature="sb")
+        def VerifyStatus(self, result, done): pass
+
+        @dbus.service.signal(BRIDGE_IFACE, signature="s")
+        def VerifyFingerSelected(self, finger): pass
+
+        @dbus.service.signal(BRIDGE_IFACE, signature="sb")
+        def EnrollStatus(self, result, done): pass
+
+    polkit_name = dbus.service.BusName(POLKIT_BUS, bus)
+    FakePolkit(polkit_name, POLKIT_OBJ)
+    FakeBridge(bus, BRIDGE_OBJ)
+    stats_name = dbus.service.BusName(STATS_BUS, bus)
+
+    # Register like egis-bridge does, every time open-fprintd (re)appears
+    def manager_owner(owner):
+        if not owner: return
+        manager = bus.get_object(FPRINT_BUS, MANAGER_OBJ, introspect=False)
+        manager.RegisterDevice(BRIDGE_OBJ, dbus_interface=MANAGER_IFACE,
+                               reply_handler=lambda: print("[LOADTEST] Bridge registered", flush=True),
+                               error_handler=lambda e: print(f"[LOADTEST] RegisterDevice failed: {e}", flush=True))
+    bus.watch_name_owner(FPRINT_BUS, manager_owner)
+
+    GLib.MainLoop().run()
+
+# ------------------ Clients --------------------------
+
+def error_name(e):
+    from gi.repository import Gio
+    remote = Gio.DBusError.get_remote_error(e)
+    return (remote or str(e)).rsplit(".", 1)[-1]
+
+class Client:
+    """One simulated client on its own bus connection. Use from a single thread."""
+    def __init__(self, address):
+        from gi.repository import Gio, GLib
+        self.Gio, self.GLib = Gio, GLib
+        self.context = GLib.MainContext.new()
+        flags = Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION
+        self.conn = Gio.DBusConnection.new_for_address_sync(address, flags, None, None)
+
+    def call(self, path, iface, method, signature=None, args=(), destination=FPRINT_BUS):
+        params = self.GLib.Variant(f"({signature})", args) if signature else None
+        result = self.conn.call_sync(destination, path, iface, method, params, None,
+                                     self.Gio.DBusCallFlags.NONE, int(CALL_TIMEOUT * 1000), None)
+        return result.unpack() if result is not None else None
+
+    def subscribe(self, path, member):
+        """Collects signals into the returned list; dispatched by pump()"""
+        received = []
+        self.context.push_thread_default()
+        try:
+            sid = self.conn.signal_subscribe(None, DEVICE_IFACE, member, path, None,
+                                             self.Gio.DBusSignalFlags.NONE,
+                                             lambda *a: received.append(a[5].unpack()))
+        finally:
+            self.context.pop_thread_default()
+        return sid, received
+
+    def unsubscribe(self, sid):
+        self.conn.signal_unsubscribe(sid)
+
+    def pump(self, done, timeout):
+        deadline = time.monotonic() + timeout
+        while not done() and time.monotonic() < deadline:
+            tick = self.GLib.timeout_source_new(10)
+            tick.set_callback(lambda *a: False)
+            tick.attach(self.context)
+            self.context.iteration(True)
+            tick.destroy()
+        return done()
+
+    def close(self):
+        self.conn.close_sync(None)
+
+class Recorder:
+    """Latencies and outcomes per call, shared by all client threads"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(Counter)
+        self.notes = Counter()
+
+    def timed(self, name, fn, *args, **kwargs):
+        from gi.repository import GLib
+        start = time.perf_counter()
+        try:
+            result, outcome = fn(*args, **kwargs), "ok"
+        except GLib.Error as e:
+            result, outcome = None, error_name(e)
+        self.add(name, time.perf_counter() - start, outcome)
+        return outcome, result
+
+    def add(self, name, elapsed, outcome="ok"):
+        with self.lock:
+            self.latencies[name].append(elapsed)
+            self.outcomes[name][outcome] += 1
+
+    def note(self, key, n=1):
+        with self.lock: self.notes[key] += n
+
+def run_parallel(clients, fn):
+    """Runs fn(index, client) on one thread per client, all released at once"""
+    barrier = threading.Barrier(len(clients))
+    errors = []
+    def body(i, client):
+        barrier.wait()
+        try: fn(i, client)
+        except Exception as e: errors.append(repr(e))
+    threads = [threading.Thread(target=body, args=(i, c)) for i, c in enumerate(clients)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return errors
+
+# ------------------ Scenarios --------------------------
+
+def scenario_claim(clients, device, rec, args):
+    for _ in range(args.rounds):
+        winners = []
+        def claim(i, c):
+            outcome, _ = rec.timed("Claim", c.call, device, DEVICE_IFACE, "Claim", "s", ("",))
+            if outcome == "ok": winners.append(c)
+        run_parallel(clients, claim)
+        if len(winners) != 1: rec.note(f"rounds with {len(winners)} claim winners")
+        for c in winners:
+            rec.timed("Release", c.call, device, DEVICE_IFACE, "Release")
+
+def scenario_list(clients, device, rec, args):
+    def lister(i, c):
+        for _ in range(args.rounds):
+            rec.timed("ListEnrolledFingers", c.call, device, DEVICE_IFACE, "ListEnrolledFingers", "s", ("",))
+    run_parallel(clients, lister)
+
+def scenario_verify(clients, device, rec, args):
+    """Whoever holds the claim storms verify/cancel; everyone else fires unclaimed VerifyStarts"""
+    match_wait = args.match_latency / 1000.0 + 5.0
+
+    def stormer(i, c):
+        rng = random.Random(i)
+        for _ in range(args.rounds):
+            outcome, _ = rec.timed("Claim", c.call, device, DEVICE_IFACE, "Claim", "s", ("",))
+            if outcome != "ok":
+                rec.timed("VerifyStart (unclaimed)", c.call, device, DEVICE_IFACE, "VerifyStart", "s", ("any",))
+                continue
+
+            for _ in range(args.cycles):
+                sid, statuses = c.subscribe(device, "VerifyStatus")
+                start = time.perf_counter()
+                outcome, _ = rec.timed("VerifyStart", c.call, device, DEVICE_IFACE, "VerifyStart", "s", ("any",))
+                if outcome == "ok" and rng.random() < args.complete_ratio:
+                    if c.pump(lambda: any(done for _, done in statuses), match_wait):
+                        rec.add("verify end-to-end", time.perf_counter() - start)
+                    else:
+                        rec.note("verifies without a final VerifyStatus")
+                rec.timed("VerifyStop", c.call, device, DEVICE_IFACE, "VerifyStop")
+                c.unsubscribe(sid)
+            rec.timed("Release", c.call, device, DEVICE_IFACE, "Release")
+    run_parallel(clients, stormer)
+
+def scenario_suspend(clients, device, rec, args, controller):
+    for _ in range(max(1, args.rounds // 4)):
+        rec.timed("Suspend", controller.call, MANAGER_OBJ, MANAGER_IFACE, "Suspend")
+
+        def lister(i, c):
+            rec.timed("ListEnrolledFingers (queued)", c.call, device, DEVICE_IFACE, "ListEnrolledFingers", "s", ("",))
+        listers = threading.Thread(target=run_parallel, args=(clients, lister))
+        listers.start()
+        time.sleep(args.suspend_hold / 1000.0)
+        rec.timed("Resume", controller.call, MANAGER_OBJ, MANAGER_IFACE, "Resume")
+        listers.join(CALL_TIMEOUT)
+        if listers.is_alive(): rec.note("queued calls still pending after Resume")
+
+# ------------------ Probes --------------------------
+
+def daemon_resources(pid):
+    def count(sub):
+        try: return len(os.listdir(f"/proc/{pid}/{sub}"))
+        except OSError: return None
+    return {"threads": count("task"), "fds": count("fd")}
+
+def match_rules(controller, name):
+    """Match rules held by a bus connection (needs dbus-daemon built with Debug.Stats)"""
+    from gi.repository import GLib
+    try:
+        owner = controller.call("/org/freedesktop/DBus", "org.freedesktop.DBus", "GetNameOwner",
+                                "s", (name,), destination="org.freedesktop.DBus")[0]
+        stats = controller.call("/org/freedesktop/DBus", "org.freedesktop.DBus.Debug.Stats", "GetConnectionStats",
+                                "s", (owner,), destination="org.freedesktop.DBus")[0]
+        return stats.get("MatchRules")
+    except GLib.Error:
+        return None
+
+def bridge_stats(controller):
+    return controller.call(BRIDGE_OBJ, STATS_IFACE, "Stats", destination=STATS_BUS)[0]
+
+def snapshot(controller, pid):
+    state = daemon_resources(pid)
+    state["match rules"] = match_rules(controller, FPRINT_BUS)
+    return state
+
+# ------------------ Report --------------------------
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))]
+
+def report(name, rec, wall, before, after, bridge):
+    print(f"\n== {name}  ({wall:.2f} s)")
+    print("  %-28s %6s %9s %9s %9s %9s %9s  outcomes" % ("call", "n", "calls/s", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+    for call, values in rec.latencies.items():
+        ms = [v * 1000 for v in values]
+        outcomes = " ".join(f"{k}={v}" for k, v in rec.outcomes[call].most_common())
+        print("  %-28s %6d %9.1f %9.1f %9.1f %9.1f %9.1f  %s" % (
+            call, len(ms), len(ms) / wall, percentile(ms, 50), percentile(ms, 95),
+            percentile(ms, 99), max(ms), outcomes))
+    for note, n in rec.notes.items():
+        print(f"  !! {note}: {n}")
+
+    leaks = []
+    for key in before:
+        if before[key] is None or after[key] is None:
+            print(f"  {key:<28} n/a")
+            continue
+        delta = after[key] - before[key]
+        print(f"  {key:<28} {before[key]} -> {after[key]}" + (f"  (+{delta} leaked)" if delta > 0 else ""))
+        if delta > 0: leaks.append(key)
+    if bridge.get("active-scans"):
+        print("  !! bridge still scanning after all clients left")
+        leaks.append("bridge scan")
+    print("  bridge: " + " ".join(f"{k}={v}" for k, v in sorted(bridge.items())))
+    return leaks
+
+# ------------------ Setup --------------------------
+
+def start_bus(workdir):
+    config = os.path.join(workdir, "bus.conf")
+    with open(config, "w") as f:
+        f.write(BUS_CONFIG.format(dir=workdir))
+    proc = subprocess.Popen(["dbus-daemon", "--config-file", config, "--nofork", "--print-address=1"],
+                            stdout=subprocess.PIPE, text=True)
+    address = proc.stdout.readline().strip()
+    if not address:
+        raise RuntimeError("dbus-daemon did not start")
+    return proc, address
+
+def wait_for_device(controller, timeout=15.0):
+    from gi.repository import GLib
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            return controller.call(MANAGER_OBJ, MANAGER_IFACE, "GetDefaultDevice")[0]
+        except GLib.Error:
+            time.sleep(0.1)
+    raise RuntimeError("open-fprintd never exposed the stand-in bridge")
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix="fprint-loadtest-")
+    procs = []
+    try:
+        bus, address = start_bus(workdir)
+        procs.append(bus)
+        print(f"[LOADTEST] Private bus at {address}")
+
+        env = dict(os.environ, DBUS_SYSTEM_BUS_ADDRESS=address,
+                   PYTHONPATH=os.pathsep.join(filter(None, [PACKAGE_DIR, os.environ.get("PYTHONPATH")])))
+        stand_in_args = [sys.executable, os.path.abspath(__file__), "--stand-ins", "--address", address,
+                         "--polkit-latency", str(args.polkit_latency), "--polkit-deny", str(args.polkit_deny),
+                         "--call-latency", str(args.call_latency), "--match-latency", str(args.match_latency),
+                         "--result", args.result]
+        procs.append(subprocess.Popen(stand_in_args, env=env))
+        daemon_cmd = [sys.executable, args.daemon, "--no-trace"] + (["--debug"] if args.debug else [])
+        daemon = subprocess.Popen(daemon_cmd, env=env)
+        procs.append(daemon)
+
+        controller = Client(address)
+        device = wait_for_device(controller)
+        print(f"[LOADTEST] Device {device}, {args.clients} clients, {args.rounds} rounds")
+
+        failed = []
+        for name in args.scenario or SCENARIOS:
+            controller.call(BRIDGE_OBJ, STATS_IFACE, "ResetStats", destination=STATS_BUS)
+            time.sleep(SETTLE_TIME)
+            before = snapshot(controller, daemon.pid)
+
+            clients = [Client(address) for _ in range(args.clients)]
+            rec = Recorder()
+            start = time.perf_counter()
+            if name == "claim": scenario_claim(clients, device, rec, args)
+            elif name == "list": scenario_list(clients, device, rec, args)
+            elif name == "verify": scenario_verify(clients, device, rec, args)
+            elif name == "suspend": scenario_suspend(clients, device, rec, args, controller)
+            wall = time.perf_counter() - start
+
+            # Disconnecting is what fires open-fprintd's owner watchers
+            for c in clients: c.close()
+            time.sleep(SETTLE_TIME)
+            if daemon.poll() is not None:
+                print(f"\n== {name}: open-fprintd exited with {daemon.returncode}")
+                failed.append(name)
+                break
+            leaks = report(name, rec, wall, before, snapshot(controller, daemon.pid), bridge_stats(controller))
+            if leaks or rec.notes: failed.append(name)
+
+        print("\n[LOADTEST] " + ("Problems in: " + ", ".join(failed) if failed else "No leaks or anomalies"))
+        return 1 if failed else 0
+    finally:
+        for p in reversed(procs):
+            p.terminate()
+            try: p.wait(5)
+            except subprocess.TimeoutExpired: p.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("open-fprintd D-Bus load test")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="Run only these (repeatable)")
+    parser.add_argument("--clients", type=int, default=16, help="Simulated client connections")
+    parser.add_argument("--rounds", type=int, default=10, help="Repetitions per client / scenario")
+    parser.add_argument("--cycles", type=int, default=5, help="VerifyStart/Stop cycles per claim")
+    parser.add_argument("--complete-ratio", type=float, default=0.3,
+                        help="Fraction of verifies waited on to the final VerifyStatus (rest are cancelled)")
+    parser.add_argument("--polkit-latency", type=float, default=5, help="ms per CheckAuthorization")
+    parser.add_argument("--polkit-deny", type=float, default=0.0, help="Fraction of authorizations refused")
+    parser.add_argument("--call-latency", type=float, default=10, help="ms per bridge method call")
+    parser.add_argument("--match-latency", type=float, default=200, help="ms from VerifyStart to VerifyStatus")
+    parser.add_argument("--result", default="verify-match", help="VerifyStatus result the bridge reports")
+    parser.add_argument("--suspend-hold", type=float, default=500, help="ms between Suspend and Resume")
+    parser.add_argument("--daemon", default=DAEMON, help="open-fprintd script to test")
+    parser.add_argument("--debug", action="store_true", help="Run open-fprintd with --debug")
+    parser.add_argument("--stand-ins", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--address", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stand_ins:
+        run_stand_ins(args)
+    else:
+        sys.exit(main(args))
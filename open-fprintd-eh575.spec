@@ -34,12 +34,13 @@ true
 %install
 # --- 1. Install to /opt/egis-driver (Matches PKGBUILD) ---
 install -d %{buildroot}/opt/egis-driver
-cp -r bin/open-fprintd bin/egis-bridge %{buildroot}/opt/egis-driver/
+cp -r bin/open-fprintd bin/egis-bridge bin/fprint-trace %{buildroot}/opt/egis-driver/
 cp -r openfprintd egis_driver %{buildroot}/opt/egis-driver/
 
 # Set executable permissions
 chmod 755 %{buildroot}/opt/egis-driver/open-fprintd
 chmod 755 %{buildroot}/opt/egis-driver/egis-bridge
+chmod 755 %{buildroot}/opt/egis-driver/fprint-trace
 
 # --- 2. Install Systemd Services ---
 install -d %{buildroot}%{_unitdir}
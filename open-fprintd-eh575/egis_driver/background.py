@@ -0,0 +1,122 @@
+import os
+import numpy as np
+
+# Floor of the touch threshold. Replayed USB captures (wireshark/*.pcapng, see
+# replay_captures.py): empty frames score <= 2.1 even across sensor sessions,
+# fingers >= 23. Sits well between the two.
+MIN_THRESHOLD = 5.0
+
+class BackgroundModel:
+    """
+    Per-pixel model of the EMPTY sensor (mean + variance).
+    Finger presence is judged by how far a frame deviates from this baseline,
+    against a threshold learned from the scores of known-empty frames.
+    """
+    def __init__(self, shape, path=None, alpha=0.05, k_sigma=5.0, min_threshold=MIN_THRESHOLD):
+        self.shape = shape
+        self.path = path
+        # EMA rate for idle updates (drift with temperature / wear is slow)
+        self.alpha = alpha
+        # Threshold = idle score mean + k_sigma * idle score std
+        self.k_sigma = k_sigma
+        self.min_threshold = min_threshold
+
+        self.mean = None
+        self.var = None
+        self.score_mean = 0.0
+        self.score_var = 0.0
+
+        # Don't hit the disk on every idle frame
+        self.save_interval = 200
+        self.updates_since_save = 0
+
+        self.load()
+
+    @property
+    def calibrated(self):
+        return self.mean is not None
+
+    @property
+    def threshold(self):
+        return max(self.min_threshold, self.score_mean + self.k_sigma * np.sqrt(self.score_var))
+
+    def score(self, arr):
+        """
+        Mean absolute z-score of the frame against the background, after removing
+        the frame's global offset (median deviation). A sensor re-init or a
+        temperature step shifts every pixel by a few DN; a finger adds texture.
+        """
+        diff = arr.astype(np.float32) - self.mean
+        diff -= np.median(diff)
+        z = np.abs(diff) / np.sqrt(self.var)
+        return float(z.mean())
+
+    def is_touched(self, arr):
+        return self.score(arr) >= self.threshold
+
+    def calibrate(self, frames):
+        """Builds the baseline from a stack of empty frames (N x H x W)."""
+        stack = np.asarray(frames, dtype=np.float32).reshape((-1,) + self.shape)
+        self.mean = stack.mean(axis=0)
+        # Floor the variance so dead/stuck pixels don't blow up the z-score
+        self.var = np.maximum(stack.var(axis=0), 1.0)
+
+        scores = np.array([self.score(f) for f in stack])
+        self.score_mean = float(scores.mean())
+        # Frames used for fitting score optimistically low, keep a sane spread
+        self.score_var = float(max(scores.var(), 0.05 ** 2))
+        self.updates_since_save = 0
+        self.save()
+
+    def update(self, arr, score=None):
+        """Folds a known-empty frame into the baseline (exponential moving average)."""
+        if score is None: score = self.score(arr)
+        a = self.alpha
+
+        diff = arr.astype(np.float32) - self.mean
+        self.mean += a * diff
+        self.var = np.maximum((1.0 - a) * (self.var + a * diff * diff), 1.0)
+
+        s_diff = score - self.score_mean
+        self.score_mean += a * s_diff
+        self.score_var = (1.0 - a) * (self.score_var + a * s_diff * s_diff)
+
+        self.updates_since_save += 1
+        if self.updates_since_save >= self.save_interval:
+            self.updates_since_save = 0
+            self.save()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path): return False
+        try:
+            with np.load(self.path) as data:
+                mean = data["mean"].astype(np.float32)
+                if mean.shape != self.shape:
+                    print(f"[DRIVER] Calibration shape mismatch {mean.shape}, ignoring.")
+                    return False
+                self.mean = mean
+                self.var = data["var"].astype(np.float32)
+                self.score_mean = float(data["score_mean"])
+                self.score_var = float(data["score_var"])
+            print(f"[DRIVER] Loaded background calibration (threshold {self.threshold:.2f})")
+            return True
+        except Exception as e:
+            print(f"[DRIVER] Failed to load calibration {self.path}: {e}")
+            return False
+
+    def save(self):
+        if not self.path or not self.calibrated: return False
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            # Write to a temp file and rename so a crash never leaves a torn file
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, mean=self.mean, var=self.var,
+                         score_mean=self.score_mean, score_var=self.score_var)
+            os.replace(tmp_path, self.path)
+            return True
+        except Exception as e:
+            print(f"[DRIVER] Failed to save calibration {self.path}: {e}")
+            return False
@@ -0,0 +1,48 @@
+import numpy as np
+
+# float - 128-D float32, as returned by SIFT (original behaviour)
+# uint8 - 128-D uint8 in RAM and on disk; OpenCV SIFT values are already
+#         integers in 0..255, so this is lossless. FLANN still gets float32.
+# pca   - uint8 storage + a PCA projection learned from the template store,
+#         used for the KD-tree and for live queries
+DESCRIPTOR_MODES = ("float", "uint8", "pca")
+PCA_DIMS = 32
+# Descriptors sampled from the store when fitting the projection
+PCA_MAX_SAMPLES = 20000
+
+def quantize(des):
+    """float32 SIFT -> uint8 (lossless for OpenCV SIFT)"""
+    if des.dtype == np.uint8: return des
+    return np.clip(np.rint(des), 0, 255).astype(np.uint8)
+
+class DescriptorPCA:
+    """Linear projection of 128-D SIFT onto its top principal components."""
+    def __init__(self, dims=PCA_DIMS):
+        self.dims = dims
+        self.mean = None
+        self.components = None
+
+    @property
+    def fitted(self):
+        return self.components is not None
+
+    def fit(self, des, max_samples=PCA_MAX_SAMPLES, seed=0):
+        data = np.asarray(des, dtype=np.float32)
+        if len(data) > max_samples:
+            rows = np.random.default_rng(seed).choice(len(data), max_samples, replace=False)
+            data = data[rows]
+
+        self.mean = data.mean(axis=0)
+        centred = data - self.mean
+        # 128x128 covariance is cheap; eigh returns ascending eigenvalues
+        cov = centred.T @ centred / max(1, len(data) - 1)
+        eigvals, eigvecs = np.linalg.eigh(cov)
+        dims = min(self.dims, data.shape[1])
+        self.components = np.ascontiguousarray(eigvecs[:, ::-1][:, :dims].T, dtype=np.float32)
+
+        kept = eigvals[::-1][:dims].sum() / max(eigvals.sum(), 1e-12)
+        print(f"[MATCHER] PCA fitted: {data.shape[1]} -> {dims} dims ({kept*100:.1f}% variance)")
+        return self
+
+    def transform(self, des):
+        return np.ascontiguousarray((np.asarray(des, dtype=np.float32) - self.mean) @ self.components.T)
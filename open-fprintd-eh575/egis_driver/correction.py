@@ -0,0 +1,110 @@
+import numpy as np
+
+# Software take on the vendor frame pipeline (ghidra_dumps/EgisTouchFP0575.c):
+# the Windows driver keeps a per-pixel background ("vdm_bk", 103x52) that the
+# sensor subtracts in hardware, a "bad_pixel" table of the same size, and a
+# "vdm target mean" the corrected frame is pulled to. We never upload vdm_bk,
+# so the same tables are built from the empty-sensor BackgroundModel and
+# applied on the host.
+
+# A pixel is bad if its background level is this many MADs off its neighbours
+BAD_PIXEL_MAD = 6.0
+# ...or its idle noise is this many times above / below the median noise
+BAD_PIXEL_NOISE = 4.0
+GAIN_LIMITS = (0.5, 2.0)
+TARGET_MEAN = 128.0
+# Banding drift is measured on pixels within this many idle-noise sigmas of the
+# baseline (uncovered sensor), never on ridges
+BACKGROUND_SIGMA = 4.0
+# Rows / columns with fewer background pixels than this fraction get no banding correction
+MIN_BACKGROUND_FRACTION = 0.25
+
+def _neighbour_median(a):
+    """Median of the 8-neighbourhood (edge-replicated), vectorized."""
+    p = np.pad(a, 1, mode="edge")
+    h, w = a.shape
+    stack = [p[1 + dy:1 + dy + h, 1 + dx:1 + dx + w]
+             for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx]
+    return np.median(np.stack(stack), axis=0)
+
+def _banding(img, background, axis):
+    """Median of the background pixels along `axis` (0 where too few), keepdims."""
+    counts = background.sum(axis=axis)
+    band = np.zeros(counts.shape, dtype=np.float32)
+    ok = np.flatnonzero(counts >= MIN_BACKGROUND_FRACTION * img.shape[axis])
+    if len(ok):
+        masked = np.where(background, img, np.nan).take(ok, axis=1 - axis)
+        band[ok] = np.nanmedian(masked, axis=axis)
+    return np.expand_dims(band, axis)
+
+class FrameCorrector:
+    """
+    Offset / gain / bad-pixel correction with precomputed tables.
+    Tables are swapped as one tuple so apply() can run on another thread.
+    """
+    def __init__(self, shape):
+        self.shape = shape
+        self.tables = None
+
+    @property
+    def ready(self):
+        return self.tables is not None
+
+    def build(self, mean, var):
+        """(Re)computes the correction tables from an empty-sensor baseline."""
+        mean = np.asarray(mean, dtype=np.float32).reshape(self.shape)
+        std = np.sqrt(np.asarray(var, dtype=np.float32).reshape(self.shape))
+
+        # 1. Bad pixels: stuck (no noise), hot (huge noise) or offset outliers
+        local = _neighbour_median(mean)
+        resid = mean - local
+        mad = np.median(np.abs(resid - np.median(resid))) * 1.4826 + 1e-3
+        med_std = float(np.median(std)) + 1e-3
+        bad = ((np.abs(resid) > BAD_PIXEL_MAD * mad) |
+               (std > BAD_PIXEL_NOISE * med_std) |
+               (std < med_std / BAD_PIXEL_NOISE))
+
+        # 2. Offset: per-pixel background, bad pixels filled from neighbours
+        offset = np.where(bad, local, mean).astype(np.float32)
+
+        # 3. Gain flattening: pixel noise scales with its analog gain
+        gain = med_std / np.where(bad, med_std, std)
+        gain = np.clip(gain, *GAIN_LIMITS).astype(np.float32)
+
+        # 4. Interpolation plan: each bad pixel averages its good 4-neighbours
+        h, w = self.shape
+        bad_idx = np.flatnonzero(bad)
+        ys, xs = np.divmod(bad_idx, w)
+        ny = np.clip(ys[:, None] + np.array([-1, 1, 0, 0]), 0, h - 1)
+        nx = np.clip(xs[:, None] + np.array([0, 0, -1, 1]), 0, w - 1)
+        nbr_idx = ny * w + nx
+        weights = (~bad.ravel()[nbr_idx]).astype(np.float32)
+        # Clusters with no good neighbour fall back to the plain 4-average
+        weights[weights.sum(axis=1) == 0] = 1.0
+        weights /= weights.sum(axis=1, keepdims=True)
+
+        # Idle noise after gain flattening: every good pixel sits at med_std
+        self.tables = (offset, gain, med_std, bad_idx, nbr_idx, weights)
+        print(f"[CORRECTION] Tables built ({len(bad_idx)} bad pixels)")
+
+    def apply(self, img_arr):
+        """Returns the corrected float32 frame centred on the vendor target mean (input if not calibrated)."""
+        tables = self.tables
+        if tables is None: return img_arr
+        offset, gain, noise, bad_idx, nbr_idx, weights = tables
+
+        img = (np.asarray(img_arr, dtype=np.float32).reshape(self.shape) - offset) * gain
+
+        if len(bad_idx):
+            flat = img.ravel()
+            flat[bad_idx] = (flat[nbr_idx] * weights).sum(axis=1)
+
+        # Residual row / column offsets (readout banding) that drift since calibration.
+        # Static banding is already in `offset`; the drift is measured where the
+        # finger isn't, so ridges running along a row or column are left alone.
+        background = np.abs(img) < BACKGROUND_SIGMA * noise
+        img -= _banding(img, background, axis=0)
+        img -= _banding(img, background, axis=1)
+
+        img += TARGET_MEAN
+        return img
@@ -3,6 +3,9 @@ import usb.util
 import time
 import numpy as np
 
+from .background import BackgroundModel
+from .correction import FrameCorrector
+
 # --- Hardware Constants ---
 VENDOR_ID = 0x1c7a
 PRODUCT_ID = 0x0575
@@ -11,12 +14,32 @@ ENDPOINT_IN = 0x82
 IMG_WIDTH = 103
 IMG_HEIGHT = 50 
 
+# --- Touch Detection ---
+CALIBRATION_FRAMES = 8
+# Consecutive "touched" frames that the legacy contrast check calls empty
+# before we assume the baseline is stale and recalibrate
+STALE_BASELINE_LIMIT = 50
+
+def frame_to_array(data):
+    """Raw USB bytes -> (IMG_HEIGHT, IMG_WIDTH) uint8 array"""
+    return np.frombuffer(bytes(data), dtype=np.uint8).reshape((IMG_HEIGHT, IMG_WIDTH))
+
 class EgisDriver:
-    def __init__(self):
+    def __init__(self, calibration_path=None):
         self.dev = self._find_device()
         # Tuned values from your interactive_scan_test.py
+        # Only used as a sanity check until the background is calibrated
         self.touch_threshold = 31.0 
+        # Only the service persists its baseline; tools (calibration_path=None)
+        # calibrate in memory and never overwrite it
+        self.background = BackgroundModel((IMG_HEIGHT, IMG_WIDTH), path=calibration_path)
+        # Offset / gain / bad-pixel tables for the matcher, derived from the background
+        self.corrector = FrameCorrector((IMG_HEIGHT, IMG_WIDTH))
+        if self.background.calibrated:
+            self.corrector.build(self.background.mean, self.background.var)
+        self._stale_count = 0
         self._initialize_sensor()
+        self.calibrate_background()
     
     def _find_device(self):
         dev = usb.core.find(idVendor=VENDOR_ID, idProduct=PRODUCT_ID)
@@ -115,8 +138,7 @@ class EgisDriver:
                 else: 
                     data = data[:target]
                 
-                arr = np.array(list(data), dtype=np.uint8)
-                contrast = np.std(arr)
+                contrast = float(np.std(frame_to_array(data)))
                 return data, contrast
                 
         except usb.core.USBError as e:
@@ -125,7 +147,56 @@ class EgisDriver:
 
         return None, 0.0
 
+    def calibrate_background(self, num_frames=CALIBRATION_FRAMES):
+        """
+        Captures empty-sensor frames and rebuilds the per-pixel baseline.
+        Frames that look touched (legacy contrast check) are skipped.
+        """
+        frames = []
+        for _ in range(num_frames * 3):
+            data, contrast = self.get_live_frame()
+            if data is None or contrast >= self.touch_threshold: continue
+            frames.append(frame_to_array(data))
+            if len(frames) >= num_frames: break
+
+        if len(frames) < num_frames // 2:
+            print("[DRIVER] Calibration skipped (sensor busy or not responding).")
+            return False
+
+        self.background.calibrate(frames)
+        self.corrector.build(self.background.mean, self.background.var)
+        self._stale_count = 0
+        print(f"[DRIVER] Background calibrated from {len(frames)} frames "
+              f"(threshold {self.background.threshold:.2f})")
+        return True
+
+    def is_finger_present(self, data, contrast):
+        """
+        Judges presence from the deviation against the empty-sensor baseline.
+        Empty frames are folded back into the baseline so it tracks drift.
+        """
+        if not self.background.calibrated:
+            return contrast >= self.touch_threshold
+
+        arr = frame_to_array(data)
+        score = self.background.score(arr)
+        if score < self.background.threshold:
+            self._stale_count = 0
+            self.background.update(arr, score)
+            return False
+
+        # Baseline says touched but the frame is flat: it might have drifted
+        if contrast < self.touch_threshold:
+            self._stale_count += 1
+            if self._stale_count >= STALE_BASELINE_LIMIT:
+                print("[DRIVER] Baseline looks stale, recalibrating...")
+                self.calibrate_background()
+        else:
+            self._stale_count = 0
+        return True
+
     def check_sensor_clear(self):
-        """Returns True if sensor is empty (contrast < threshold)"""
-        _, contrast = self.get_live_frame()
-        return contrast < self.touch_threshold
+        """Returns True if sensor is empty (no deviation from the background)"""
+        data, contrast = self.get_live_frame()
+        if data is None: return True
+        return not self.is_finger_present(data, contrast)
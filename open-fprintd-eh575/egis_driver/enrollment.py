@@ -0,0 +1,182 @@
+import cv2
+import numpy as np
+
+from .geometry import GeometricVerifier
+
+FRAME_SHAPE = (50, 103)
+# Finish once the registered scans cover this many sensor-frames of finger.
+# Simulated sessions (random touches over a synthetic pad of ~5 frames, 40
+# random probes per finger): verify success 0.74 at 2.0, 0.77 at 3.0 and 4.0,
+# while 4.0 takes ~12 scans against ~7.
+TARGET_COVERAGE = 3.0
+MIN_STAGES = 5
+MAX_STAGES = 15
+# Usable touches (accepted or duplicate) before the session settles for what
+# it has: duplicates are then accepted too, like the old fixed-stage flow
+MAX_TOUCHES = 30
+MIN_KEYPOINTS = 10
+# A registered scan adding less than this fraction of a frame is a duplicate
+MIN_NEW_AREA = 0.10
+# Inliers needed to place a scan relative to an accepted one
+MIN_REGISTER_INLIERS = 8
+
+class EnrollmentSession:
+    """
+    Incremental enrollment: every touch is feature-extracted and registered
+    against the scans already accepted, so coverage of the finger is known
+    as we go. Duplicates are refused and the session completes as soon as
+    the coverage target is met (or MAX_STAGES scans were accepted).
+
+    Scans that don't register to anything start a new "island". Islands are
+    merged as soon as a later scan registers to both. Only registered area
+    counts: coverage is the area of the largest (main) island, and only its
+    scans count as stages and are kept (see result()), so another finger or
+    garbage that never links up is dropped when the session completes.
+
+    Rejected touches are free. After MAX_TOUCHES usable ones the session stops
+    refusing duplicates and completes as soon as MIN_STAGES scans are on the
+    main island, so it never fails where the fixed-stage flow succeeded.
+    """
+    def __init__(self, matcher, target_coverage=TARGET_COVERAGE,
+                 min_stages=MIN_STAGES, max_stages=MAX_STAGES, max_touches=MAX_TOUCHES):
+        self.matcher = matcher
+        self.target_coverage = target_coverage
+        self.min_stages = min_stages
+        self.max_stages = max_stages
+        self.max_touches = max_touches
+        self.touches = 0
+        # Similarity + RANSAC: placement only needs a rigid-ish transform.
+        # Keeps the looser 10 px fit placement was written with, not the verify default.
+        self.geometry = GeometricVerifier("similarity", "ransac", reproj_threshold=10.0)
+        self.bf = cv2.BFMatcher(cv2.NORM_L2)
+
+        h, w = FRAME_SHAPE
+        self.frame_area = float(h * w)
+        # Canvas with room for a frame's worth of drift in every direction
+        self.canvas_shape = (3 * h, 3 * w)
+        self.canvas_origin = np.array([[1, 0, w], [0, 1, h]], dtype=np.float64)
+        self.footprint = np.ones(FRAME_SHAPE, dtype=np.uint8)
+
+        self.templates = []   # (packed_kp, des) per stage, see result()
+        self.stages = []      # (points (N,2) float32, des float32, island, transform to island canvas)
+        self.islands = []     # bool canvases (None once merged into another island)
+
+    @property
+    def main_island(self):
+        live = [i for i, c in enumerate(self.islands) if c is not None]
+        return max(live, key=lambda i: int(np.count_nonzero(self.islands[i])), default=None)
+
+    @property
+    def main_stages(self):
+        main = self.main_island
+        return sum(1 for _, _, island, _ in self.stages if island == main)
+
+    @property
+    def coverage(self):
+        main = self.main_island
+        return 0.0 if main is None else np.count_nonzero(self.islands[main]) / self.frame_area
+
+    @property
+    def out_of_touches(self):
+        return self.touches >= self.max_touches
+
+    @property
+    def progress(self):
+        """0..1 for the UI; 1 only when done"""
+        if self.done: return 1.0
+        by_coverage = self.coverage / self.target_coverage
+        by_count = self.main_stages / (self.min_stages if self.out_of_touches else self.max_stages)
+        return min(0.99, max(by_coverage, by_count))
+
+    @property
+    def done(self):
+        stages = self.main_stages
+        if stages >= self.max_stages: return True
+        return stages >= self.min_stages and (self.coverage >= self.target_coverage or self.out_of_touches)
+
+    def result(self):
+        """(packed_kp, des) of the scans on the main island, ready for matcher.save_templates"""
+        main = self.main_island
+        return [t for t, (_, _, island, _) in zip(self.templates, self.stages) if island == main]
+
+    def _register(self, pts, des):
+        """Best placement of the new scan on each island: {island: (M new->island canvas, inliers)}"""
+        best = {}
+        for s_pts, s_des, island, to_canvas in self.stages:
+            pairs = self.bf.knnMatch(des, s_des, k=2)
+            good = [p[0] for p in pairs if len(p) == 2 and p[0].distance < 0.85 * p[1].distance]
+            if len(good) < MIN_REGISTER_INLIERS: continue
+
+            q = np.array([m.queryIdx for m in good])
+            t = np.array([m.trainIdx for m in good])
+            dist = np.array([m.distance for m in good], dtype=np.float32)
+            M, inliers = self.geometry.estimate(pts[q], s_pts[t], dist)
+            if M is not None and inliers > best.get(island, (None, 0))[1]:
+                # new -> stage -> island canvas
+                best[island] = (to_canvas @ np.vstack([M[:2], [0, 0, 1]]), inliers)
+        return best
+
+    def _merge(self, into, other, to_into, to_other):
+        """Moves island `other` (and its stages) onto `into`, given the new scan's transform to each"""
+        other_to_into = to_into @ np.linalg.inv(to_other)
+        moved = cv2.warpAffine(self.islands[other].astype(np.uint8), other_to_into[:2].astype(np.float32),
+                               self.canvas_shape[::-1], flags=cv2.INTER_NEAREST, borderValue=0) > 0
+        self.islands[into] |= moved
+        self.islands[other] = None
+        self.stages = [(p, d, into, other_to_into @ t) if i == other else (p, d, i, t)
+                       for p, d, i, t in self.stages]
+
+    def _warp_footprint(self, transform):
+        return cv2.warpAffine(self.footprint, transform.astype(np.float32), self.canvas_shape[::-1],
+                              flags=cv2.INTER_NEAREST, borderValue=0) > 0
+
+    def add_scan(self, raw):
+        """
+        Evaluates one touch. Returns (status, info) where status is:
+          "accepted"  - kept; info has keypoints / new_area / overlap / coverage
+          "duplicate" - overlaps accepted scans and adds almost nothing
+          "rejected"  - unusable (quality gate or too few keypoints)
+        Every info carries the frame's quality score. Accepted and duplicate
+        touches count against max_touches.
+        """
+        quality = self.matcher.assess_quality(raw)["score"]
+        if quality < self.matcher.min_quality:
+            return "rejected", {"quality": quality, "keypoints": 0}
+
+        template = self.matcher.extract_template(raw)
+        if template is None or len(template[0]) < MIN_KEYPOINTS:
+            return "rejected", {"quality": quality, "keypoints": 0 if template is None else len(template[0])}
+
+        self.touches += 1
+        packed_kp, des = template
+        pts = np.float32([kp[0] for kp in packed_kp])
+        des_f = np.asarray(des, dtype=np.float32)
+
+        placements = self._register(pts, des_f) if self.stages else {}
+        inliers = max((n for _, n in placements.values()), default=0)
+        if placements:
+            # Land on the largest island; the others are now linked to it
+            island = max(placements, key=lambda i: np.count_nonzero(self.islands[i]))
+            to_canvas = placements[island][0]
+            for other, (to_other, _) in placements.items():
+                if other != island: self._merge(island, other, to_canvas, to_other)
+
+            mask = self._warp_footprint(to_canvas[:2])
+            canvas = self.islands[island]
+            new_area = np.count_nonzero(mask & ~canvas) / self.frame_area
+            overlap = np.count_nonzero(mask & canvas) / max(1, np.count_nonzero(mask))
+            if new_area < MIN_NEW_AREA and not self.out_of_touches:
+                return "duplicate", {"quality": quality, "keypoints": len(packed_kp), "new_area": new_area,
+                                     "overlap": overlap, "inliers": inliers}
+            canvas |= mask
+        else:
+            # Nothing to register against: start a new island (no coverage credit until it links up)
+            island = len(self.islands)
+            to_canvas = np.vstack([self.canvas_origin, [0, 0, 1]])
+            self.islands.append(self._warp_footprint(self.canvas_origin))
+            new_area, overlap = 0.0, 0.0
+
+        self.stages.append((pts, des_f, island, to_canvas))
+        self.templates.append(template)
+        return "accepted", {"quality": quality, "keypoints": len(packed_kp), "new_area": new_area, "overlap": overlap,
+                            "inliers": inliers, "coverage": self.coverage}
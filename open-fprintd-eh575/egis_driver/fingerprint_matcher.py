@@ -1,11 +1,167 @@
 import cv2
 import numpy as np
 import os
+import threading
 import time
+import weakref
+
+from .quality import frame_quality, QUALITY_THRESHOLD
+from .sharded_index import ShardedIndex
+from .compact import DESCRIPTOR_MODES, PCA_DIMS, DescriptorPCA, quantize
+from .signature import SHORTLIST, SHORTLIST_KNN, GlobalSignature
+from .geometry import GeometricVerifier
+
+# Lowe ratio test for knn (k=2) pairs
+RATIO_TEST = 0.85
+# Matches a template needs before it is geometrically verified
+MIN_VOTES = 4
+
+def preprocess(img_array, corrector=None):
+    """Standard preprocessing pipeline for SIFT"""
+    if corrector is not None:
+        img_array = corrector.apply(img_array)
+    img = cv2.normalize(img_array, None, 0, 255, cv2.NORM_MINMAX).astype('uint8')
+    img = cv2.equalizeHist(img)
+    img = cv2.GaussianBlur(img, (3, 3), 0)
+    return img
+
+# Preprocessing a template was extracted with, stored next to it.
+# Templates from before sensor correction carry no version (= PREPROCESS_RAW).
+PREPROCESS_RAW = 0
+PREPROCESS_CORRECTED = 1
+
+def preprocess_version(corrector):
+    """Version preprocess() produces with this corrector"""
+    return PREPROCESS_CORRECTED if corrector is not None and corrector.ready else PREPROCESS_RAW
+
+def list_enrolled_fingers(enroll_dir, username):
+    """Finger names stored for username (<username>_<finger>.npy)"""
+    fingers = []
+    prefix = f"{username}_"
+    for filename in os.listdir(enroll_dir):
+        if filename.startswith(prefix) and filename.endswith(".npy"):
+            fingers.append(filename[len(prefix):-4])
+    return fingers
+
+class IndexSnapshot:
+    """
+    Immutable view of the template store: descriptor pile, keypoint positions,
+    template boundaries, VLAD signatures and the search index built over them.
+
+    rebuild_index() builds a complete new snapshot and publishes it with a
+    single reference swap (read-copy-update). Readers take `matcher.snapshot`
+    once and use only that object, so a verify never sees half-rebuilt state
+    and never waits for a rebuild. An old snapshot is freed as soon as its
+    last reader drops it; its generation of the sharded index goes with it.
+    """
+    def __init__(self, template_keys=(), template_offsets=None, train_descriptors=None, train_points=None,
+                 pca=None, signature=None, template_signatures=None, flann=None, sharded=None):
+        self.template_keys = list(template_keys)   # (filename, index in file) per template
+        # Enrolled file (finger) of every template, as an index into file_names
+        self.file_names = sorted({filename for filename, _ in self.template_keys})
+        file_ids = {filename: i for i, filename in enumerate(self.file_names)}
+        self.template_files = np.array([file_ids[filename] for filename, _ in self.template_keys], dtype=np.int64)
+        # Global descriptor i belongs to the template t with
+        # template_offsets[t] <= i < template_offsets[t + 1]; train_points[i] is its
+        # keypoint position. cached_templates only holds views into these arrays.
+        self.template_offsets = template_offsets if template_offsets is not None else np.zeros(1, dtype=np.int64)
+        self.train_descriptors = train_descriptors
+        self.train_points = train_points
+        self.pca = pca
+        self.signature = signature
+        self.template_signatures = template_signatures
+        self.flann = flann
+        self.sharded = sharded
+
+        self.cached_templates = {}
+        for t, (filename, _) in enumerate(self.template_keys):
+            start, end = self.template_offsets[t], self.template_offsets[t + 1]
+            self.cached_templates.setdefault(filename, []).append(
+                (self.train_points[start:end], self.train_descriptors[start:end]))
+
+        # Only taken if the sharded index dies and a local tree has to be built
+        self._fallback_lock = threading.Lock()
+        if sharded is not None:
+            weakref.finalize(self, sharded.close)
+
+    @property
+    def empty(self):
+        return self.train_descriptors is None
+
+    def index_view(self, des):
+        """Representation fed to FLANN (always float32) and used for queries"""
+        if self.pca is not None and self.pca.fitted:
+            return self.pca.transform(des)
+        return np.asarray(des, dtype=np.float32)
+
+    def knn_match(self, des, k=2):
+        sharded = self.sharded
+        if sharded is not None:
+            try:
+                return sharded.knnMatch(des, k=k)
+            except Exception as e:
+                self._fall_back_to_local(e)
+        flann = self.flann
+        if flann is None:
+            flann = self._build_local()
+        return flann.knnMatch(des, k=k)
+
+    def knn_arrays(self, des, k=2):
+        """knn as (idx, dist) (N, k) arrays, ascending distance; -1 / inf where fewer than k"""
+        sharded = self.sharded
+        if sharded is not None:
+            try:
+                return sharded.knn_arrays(des, k=k)
+            except Exception as e:
+                self._fall_back_to_local(e)
+        rows = self.knn_match(des, k=k)
+        idx = np.full((len(rows), k), -1, dtype=np.int64)
+        dist = np.full((len(rows), k), np.inf, dtype=np.float32)
+        for q, row in enumerate(rows):
+            for j, m in enumerate(row[:k]):
+                idx[q, j], dist[q, j] = m.trainIdx, m.distance
+        return idx, dist
+
+    def _build_local(self):
+        """In-process tree, once the shards of this snapshot are gone"""
+        with self._fallback_lock:
+            if self.flann is None:
+                flann = _new_flann()
+                flann.add([self.index_view(self.train_descriptors)])
+                flann.train()
+                self.flann = flann
+            return self.flann
+
+    def _fall_back_to_local(self, error):
+        """A shard died: this snapshot answers from an in-process tree from now on."""
+        with self._fallback_lock:
+            if self.sharded is None: return
+            print(f"[MATCHER] Sharded index failed ({error}), falling back to local tree.")
+            sharded, self.sharded = self.sharded, None
+        self._build_local()
+        try: sharded.close()
+        except Exception: pass
+
+def _new_flann():
+    # FLANN Configuration (KD-Tree for SIFT)
+    # Algorithm 1 = FLANN_INDEX_KDTREE
+    index_params = dict(algorithm=1, trees=5)
+    # Checks = 50 gives good precision/speed balance
+    search_params = dict(checks=50)
+    return cv2.FlannBasedMatcher(index_params, search_params)
 
 class FingerprintMatcher:
-    def __init__(self, enroll_dir="/var/lib/open-fprintd/egis"):
+    def __init__(self, enroll_dir="/var/lib/open-fprintd/egis", corrector=None, shards=0,
+                 descriptor_mode="float", pca_dims=PCA_DIMS, shortlist=SHORTLIST,
+                 geometry=None):
         self.enroll_dir = enroll_dir
+        if descriptor_mode not in DESCRIPTOR_MODES:
+            raise ValueError(f"Unknown descriptor mode: {descriptor_mode}")
+        # Storage / index representation of SIFT descriptors (see compact.py)
+        self.descriptor_mode = descriptor_mode
+        self.pca_dims = pca_dims
+        # Optional correction.FrameCorrector (sensor offset/gain/bad-pixel tables)
+        self.corrector = corrector
         if not os.path.exists(enroll_dir):
             try:
                 os.makedirs(enroll_dir)
@@ -15,112 +171,280 @@ class FingerprintMatcher:
         # SIFT Configuration
         self.sift = cv2.SIFT_create()
 
-        # FLANN Configuration (KD-Tree for SIFT)
-        # Algorithm 1 = FLANN_INDEX_KDTREE
-        index_params = dict(algorithm=1, trees=5)
-        # Checks = 50 gives good precision/speed balance
-        search_params = dict(checks=50)
-        self.flann = cv2.FlannBasedMatcher(index_params, search_params)
-
-        # Cache for Tree Lookup
-        # self.descriptor_map maps a range of global indices back to a specific template
-        self.descriptor_map = [] 
-        self.cached_templates = {} 
-        self.train_descriptors = None
-        
+        # Frames below this quality are rejected before SIFT
+        self.min_quality = QUALITY_THRESHOLD
+
+        # Optional: spread the index over worker processes (large template sets).
+        # The workers live as long as the matcher; every snapshot gets its own
+        # generation of shards on them (see ShardedIndex).
+        self.shards = shards
+        self.sharded_index = None
+
+        # Coarse stage: per-template VLAD signatures (0 disables the prefilter).
+        # Once more fingers are enrolled than this, verify only takes matches
+        # into the templates of the best-scoring fingers (see _candidate_matches).
+        self.shortlist = shortlist
+
+        # Geometric check of the winning template (similarity + RANSAC by default);
+        # it also decides how many inliers make a match
+        self.geometry = geometry if geometry is not None else GeometricVerifier()
+
+        # Published index state; replaced whole, never modified (see IndexSnapshot).
+        # Writers (file changes + rebuilds) serialize on _write_lock, readers never lock.
+        self._write_lock = threading.RLock()
+        self.snapshot = IndexSnapshot()
+
         # Build the tree on startup
         self.rebuild_index()
 
+    # Current snapshot's state, for tools that inspect the index
+    @property
+    def train_descriptors(self): return self.snapshot.train_descriptors
+    @property
+    def train_points(self): return self.snapshot.train_points
+    @property
+    def template_offsets(self): return self.snapshot.template_offsets
+    @property
+    def template_keys(self): return self.snapshot.template_keys
+    @property
+    def template_signatures(self): return self.snapshot.template_signatures
+    @property
+    def cached_templates(self): return self.snapshot.cached_templates
+
     def _preprocess(self, img_array):
-        """Standard preprocessing pipeline for SIFT"""
-        img = cv2.normalize(img_array, None, 0, 255, cv2.NORM_MINMAX).astype('uint8')
-        img = cv2.equalizeHist(img)
-        img = cv2.GaussianBlur(img, (3, 3), 0)
-        return img
+        return preprocess(img_array, self.corrector)
+
+    def assess_quality(self, raw_frame):
+        """Cheap pre-SIFT quality score (see quality.frame_quality)"""
+        img_arr = np.array(list(raw_frame), dtype=np.uint8).reshape((50, 103))
+        return frame_quality(img_arr)
+
+    def _storage_view(self, des):
+        """Representation kept in RAM and written to disk"""
+        if self.descriptor_mode == "float": return des
+        return quantize(des)
+
+    def _index_view(self, des, snap=None):
+        return (snap or self.snapshot).index_view(des)
 
     def rebuild_index(self):
         """
         Loads ALL templates from disk and builds a single FLANN KD-Tree.
         This enables O(1) lookup instead of O(N) linear scanning.
+        The result is published as a new snapshot; verifies running meanwhile
+        finish on the previous one.
         """
+        with self._write_lock:
+            self.snapshot = self._build_snapshot()
+
+    def _build_snapshot(self):
         print("[MATCHER] Rebuilding Global FLANN Index...")
         start_t = time.time()
 
         all_descriptors = []
-        self.descriptor_map = [] 
-        self.cached_templates = {}
-
-        current_idx_offset = 0
+        all_points = []
+        offsets = [0]
+        template_keys = []
+        # Files with templates extracted under other preprocessing than probes get now
+        version = preprocess_version(self.corrector)
+        stale_files = []
 
         # Load every .npy file in the directory
         for filename in os.listdir(self.enroll_dir):
             if not filename.endswith(".npy"): continue
-            
+
             try:
-                # Load templates: List of (packed_kp, des)
+                # Load templates: List of (packed_kp, des[, preprocess version])
                 raw_data = np.load(os.path.join(self.enroll_dir, filename), allow_pickle=True)
-                
-                unpacked_templates = []
-                for t_idx, (packed_kp, des) in enumerate(raw_data):
+
+                templates = []
+                stale = False
+                for t_idx, entry in enumerate(raw_data):
+                    packed_kp, des = entry[0], entry[1]
+                    stale |= (entry[2] if len(entry) > 2 else PREPROCESS_RAW) != version
                     if des is None or len(des) < 2: continue
-                    
-                    # Unpack KeyPoints for RANSAC usage
-                    kp = [cv2.KeyPoint(x=pt[0], y=pt[1], size=sz, angle=ang, response=resp, octave=oct, class_id=cid) 
-                          for (pt, sz, ang, resp, oct, cid) in packed_kp]
-                    
-                    unpacked_templates.append((kp, des))
-
-                    # Add descriptors to the Global Pile
+                    # RANSAC only needs the positions, not whole KeyPoints
+                    pts = np.array([kp[0] for kp in packed_kp], dtype=np.float32).reshape(-1, 2)
+                    if len(pts) != len(des): continue
+                    templates.append((t_idx, pts, self._storage_view(des)))
+
+                # Only commit a file once all of it parsed
+                for t_idx, pts, des in templates:
+                    all_points.append(pts)
                     all_descriptors.append(des)
-                    
-                    # Map global indices to this specific template
-                    num_des = len(des)
-                    self.descriptor_map.append({
-                        "start": current_idx_offset,
-                        "end": current_idx_offset + num_des,
-                        "file": filename,
-                        "idx": t_idx 
-                    })
-                    current_idx_offset += num_des
-                
-                self.cached_templates[filename] = unpacked_templates
+                    offsets.append(offsets[-1] + len(des))
+                    template_keys.append((filename, t_idx))
+                if stale: stale_files.append(filename)
 
             except Exception as e:
                 print(f"[MATCHER] Failed to load {filename}: {e}")
 
-        # Build the actual Tree
-        if all_descriptors:
-            self.train_descriptors = np.vstack(all_descriptors)
-            self.flann.clear()
-            self.flann.add([self.train_descriptors])
-            self.flann.train()
-            print(f"[MATCHER] Index built in {time.time()-start_t:.2f}s. Total Features: {current_idx_offset}")
-        else:
+        if stale_files:
+            # Raw frames aren't kept, so these can't be re-extracted: scores against
+            # them are lower until the finger is enrolled again
+            print(f"[MATCHER] WARNING: {len(stale_files)} prints were enrolled with different frame "
+                  f"preprocessing and should be re-enrolled: {', '.join(sorted(stale_files))}")
+
+        if not all_descriptors:
             print("[MATCHER] Index is empty (no enrolled prints).")
-            self.train_descriptors = None
+            return IndexSnapshot()
+
+        template_offsets = np.array(offsets, dtype=np.int64)
+        train_descriptors = np.vstack(all_descriptors)
+        train_points = np.vstack(all_points)
+
+        pca = None
+        if self.descriptor_mode == "pca":
+            pca = DescriptorPCA(self.pca_dims)
+            pca.fit(train_descriptors)
+        index_descriptors = pca.transform(train_descriptors) if pca is not None \
+            else np.asarray(train_descriptors, dtype=np.float32)
+
+        signature, template_signatures = self._build_signatures(index_descriptors, template_offsets)
+
+        # Build the actual Tree (or its shards); the shortlist is searched through it too
+        flann = None
+        sharded = self._build_sharded(index_descriptors)
+        if sharded is None:
+            flann = _new_flann()
+            flann.add([index_descriptors])
+            flann.train()
+        print(f"[MATCHER] Index built in {time.time()-start_t:.2f}s. Total Features: {offsets[-1]}")
+
+        return IndexSnapshot(template_keys, template_offsets, train_descriptors, train_points,
+                             pca, signature, template_signatures, flann, sharded)
+
+    def _build_signatures(self, index_descriptors, bounds):
+        """One VLAD vector per template, stacked so the coarse stage is a single matmul"""
+        if self.shortlist <= 0:
+            return None, None
+        signature = GlobalSignature()
+        signature.fit(index_descriptors)
+        template_signatures = np.stack([
+            signature.compute(index_descriptors[bounds[t]:bounds[t + 1]]) for t in range(len(bounds) - 1)
+        ])
+        return signature, template_signatures
+
+    def _build_sharded(self, index_descriptors):
+        """New generation on the long-lived shard workers (ShardView), or None"""
+        if self.shards <= 1: return None
+        try:
+            if self.sharded_index is None:
+                self.sharded_index = ShardedIndex(self.shards)
+            return self.sharded_index.build(index_descriptors)
+        except Exception as e:
+            # A shard died or failed to build: fall back to the in-process tree for good.
+            print(f"[MATCHER] Sharded index failed ({e}), falling back to local tree.")
+            self.shards = 0
+            if self.sharded_index is not None:
+                try: self.sharded_index.close()
+                except Exception: pass
+            return None
+
+    def _knn_match(self, des, k=2, snap=None):
+        return (snap or self.snapshot).knn_match(des, k=k)
+
+    @staticmethod
+    def _ratio_filter(rows):
+        """knn (k=2) DMatch rows -> (queryIdx, trainIdx, distance) arrays of the pairs passing the ratio test"""
+        flat = np.array([(r[0].queryIdx, r[0].trainIdx, r[0].distance, r[1].distance)
+                         for r in rows if len(r) >= 2], dtype=np.float64).reshape(-1, 4)
+        keep = flat[:, 2] < RATIO_TEST * flat[:, 3]
+        return flat[keep, 0].astype(np.int64), flat[keep, 1].astype(np.int64), flat[keep, 2].astype(np.float32)
+
+    def shortlisted_templates(self, des_query, snap=None, exclude=None):
+        """
+        Templates of the `shortlist` fingers whose best template signature is
+        closest to the probe, as a boolean mask, or None if every finger is in.
+        exclude: template whose signature doesn't count (leave-one-out tools).
+        """
+        snap = snap or self.snapshot
+        if snap.template_signatures is None or len(snap.file_names) <= self.shortlist:
+            return None
+        scores = snap.template_signatures @ snap.signature.compute(des_query)
+        if exclude is not None: scores[exclude] = -np.inf
+        finger_scores = np.full(len(snap.file_names), -np.inf, dtype=np.float32)
+        np.maximum.at(finger_scores, snap.template_files, scores)
+        top = np.argpartition(-finger_scores, self.shortlist)[:self.shortlist]
+        return np.isin(snap.template_files, top)
+
+    def _candidate_matches(self, des_query, snap=None):
+        """
+        Ratio-tested matches as (queryIdx, GLOBAL trainIdx, distance) arrays.
+        With many fingers, only matches into the VLAD shortlist are kept;
+        either way the query goes through the tree / shards.
+        """
+        snap = snap or self.snapshot
+        allowed = self.shortlisted_templates(des_query, snap)
+        if allowed is None:
+            return self._ratio_filter(snap.knn_match(des_query, k=2))
+        idx, dist = snap.knn_arrays(des_query, k=SHORTLIST_KNN)
+        return self._shortlist_filter(idx, dist, allowed, snap)
+
+    @staticmethod
+    def _shortlist_filter(idx, dist, allowed, snap):
+        """
+        Ratio test over the neighbours that fall into shortlisted templates.
+        idx / dist: (N, k) knn arrays as from knn_arrays(), allowed: per-template mask.
+        When only one of the k neighbours is shortlisted, the k-th distance
+        stands in for its runner-up (the real one is at least that far).
+        """
+        owners = np.searchsorted(snap.template_offsets, np.maximum(idx, 0), side="right") - 1
+        ok = (idx >= 0) & allowed[owners]
+        # Shortlisted neighbours first, still in distance order
+        order = np.argsort(~ok, axis=1, kind="stable")
+        idx = np.take_along_axis(idx, order, axis=1)
+        near = np.take_along_axis(dist, order, axis=1)
+        n_ok = ok.sum(axis=1)
+
+        full = dist[:, -1] < np.inf
+        runner_up = np.where(n_ok >= 2, near[:, min(1, near.shape[1] - 1)],
+                             np.where(full, dist[:, -1], np.nan))
+        with np.errstate(invalid="ignore"):
+            keep = (n_ok >= 1) & (near[:, 0] < RATIO_TEST * runner_up)
+        rows = np.flatnonzero(keep)
+        return rows.astype(np.int64), idx[rows, 0].astype(np.int64), near[rows, 0].astype(np.float32)
+
+    def extract_template(self, raw):
+        """
+        Quality gate + SIFT for one scan.
+        Returns (packed_kp, des) ready for storage, or None if the scan is unusable.
+        """
+        img_arr = np.array(list(raw), dtype=np.uint8).reshape((50, 103))
+        quality = frame_quality(img_arr)
+        if quality["score"] < self.min_quality:
+            print(f"[MATCHER] Skipping low quality scan ({quality['score']:.2f})")
+            return None
+
+        img = self._preprocess(img_arr)
+        kp, des = self.sift.detectAndCompute(img, None)
+        
+        if des is None or len(kp) <= 5:
+            return None
+        # Pack KeyPoints for serialization
+        packed_kp = [(p.pt, p.size, p.angle, p.response, p.octave, p.class_id) for p in kp]
+        return packed_kp, self._storage_view(des)
 
     def enroll_finger(self, name, raw_frames):
         """
         Appends new scans to the existing user file instead of overwriting.
         This allows the user to 'add' to their print definition.
         """
-        new_templates = []
-        
         print(f"[MATCHER] Enrolling {name} (Appending {len(raw_frames)} scans)...")
 
         # 1. Process New Scans
-        for raw in raw_frames:
-            img_arr = np.array(list(raw), dtype=np.uint8).reshape((50, 103))
-            img = self._preprocess(img_arr)
-            kp, des = self.sift.detectAndCompute(img, None)
-            
-            if des is not None and len(kp) > 5:
-                # Pack KeyPoints for serialization
-                packed_kp = [(p.pt, p.size, p.angle, p.response, p.octave, p.class_id) for p in kp]
-                new_templates.append((packed_kp, des))
-        
+        new_templates = [t for t in (self.extract_template(raw) for raw in raw_frames) if t is not None]
+        return self.save_templates(name, new_templates)
+
+    def save_templates(self, name, new_templates):
+        """Appends already extracted (packed_kp, des) templates to the user file and rebuilds the index."""
         if not new_templates:
             return False
+        # Read-modify-write of the file + rebuild, one writer at a time
+        with self._write_lock:
+            return self._save_templates(name, new_templates)
+
+    def _save_templates(self, name, new_templates):
 
         # 2. Load Existing Scans (Append Mode)
         safe_name = name.replace("/", "_")
@@ -134,9 +458,13 @@ class FingerprintMatcher:
             except:
                 print("[MATCHER] Existing file corrupt, starting fresh.")
 
-        # 3. Save Combined Data
-        final_data = existing_data + new_templates
-        np.save(file_path, np.array(final_data, dtype=object))
+        # 3. Save Combined Data, new templates stamped with the preprocessing they went through
+        version = preprocess_version(self.corrector)
+        final_data = [tuple(t) for t in existing_data] + [(kp, des, version) for kp, des in new_templates]
+        # 1-D object array: np.array() would try to broadcast same-sized templates
+        stored = np.empty(len(final_data), dtype=object)
+        for i, template in enumerate(final_data): stored[i] = template
+        np.save(file_path, stored)
         
         print(f"[MATCHER] Saved. Total templates for {name}: {len(final_data)}")
         
@@ -144,85 +472,71 @@ class FingerprintMatcher:
         self.rebuild_index()
         return True
 
-    def verify_finger(self, raw_frame):
+    def verify_finger(self, raw_frame, check_quality=True):
         """
-        1. Query Global Tree -> Vote for best template.
+        0. Quality gate -> Don't waste SIFT on smudges / edge touches.
+        1. VLAD shortlist + knn -> Vote for best template.
         2. RANSAC -> Verify geometry of the winner.
         """
-        if self.train_descriptors is None: return None, 0
+        # One snapshot for the whole verify, even if a rebuild publishes a new one meanwhile
+        snap = self.snapshot
+        if snap.empty: return None, 0
 
         img_arr = np.array(list(raw_frame), dtype=np.uint8).reshape((50, 103))
+        if check_quality:
+            quality = frame_quality(img_arr)
+            if quality["score"] < self.min_quality:
+                print(f"[MATCHER] Rejected low quality frame ({quality['score']:.2f})")
+                return None, 0
+
         img = self._preprocess(img_arr)
         kp_live, des_live = self.sift.detectAndCompute(img, None)
         
         if des_live is None or len(kp_live) < 4: return None, 0
 
         # --- STEP 1: Global Voting ---
-        # Find 2 nearest neighbors in the ENTIRE database
-        matches = self.flann.knnMatch(des_live, k=2)
-        
-        good_matches = []
-        for m, n in matches:
-            if m.distance < 0.85 * n.distance:
-                good_matches.append(m)
-
-        if len(good_matches) < 4: return None, 0
-
-        # Tally Votes: Which template owns these matched descriptors?
-        candidate_votes = {}
-        
-        for m in good_matches:
-            global_idx = m.trainIdx
-            
-            # Map global index -> (Filename, TemplateIdx)
-            # Since map is ordered, we can just iterate. Fast enough for <500 templates.
-            found_owner = None
-            for entry in self.descriptor_map:
-                if entry["start"] <= global_idx < entry["end"]:
-                    found_owner = entry
-                    break
-            
-            if found_owner:
-                key = (found_owner["file"], found_owner["idx"])
-                if key not in candidate_votes:
-                    candidate_votes[key] = []
-                
-                # IMPORTANT: Convert Global Index to Local Index for RANSAC
-                local_train_idx = global_idx - found_owner["start"]
-                new_m = cv2.DMatch(m.queryIdx, local_train_idx, m.imgIdx, m.distance)
-                candidate_votes[key].append(new_m)
-
-        if not candidate_votes: return None, 0
+        # Find 2 nearest neighbors among the shortlisted fingers (or the ENTIRE database)
+        query_idx, train_idx, distances = self._candidate_matches(snap.index_view(des_live), snap)
 
         # --- STEP 2: Pick Winner & Verify ---
-        # Sort by vote count
-        sorted_candidates = sorted(candidate_votes.items(), key=lambda item: len(item[1]), reverse=True)
-        
         # Check top candidate only (O(1) Check)
-        best_candidate_key, best_candidate_matches = sorted_candidates[0]
-        filename, t_idx = best_candidate_key
-        
-        # Retrieve KeyPoints from RAM cache
-        if filename not in self.cached_templates: return None, 0
-        kp_stored, des_stored = self.cached_templates[filename][t_idx]
+        scores = self.template_scores(cv2.KeyPoint_convert(kp_live), query_idx, train_idx, distances, top=1, snap=snap)
+        if not scores: return None, 0
+        best, _, inliers = scores[0]
+
+        # Threshold depends on the geometry model (see geometry.MODEL_DEFAULTS)
+        if inliers >= self.geometry.min_inliers:
+            filename, _ = snap.template_keys[best]
+            name = filename.replace(".npy", "")
+            return name, inliers
 
-        if len(best_candidate_matches) < 4: return None, 0
+        return None, 0
 
-        # Prepare points for RANSAC
-        src_pts = np.float32([kp_live[m.queryIdx].pt for m in best_candidate_matches]).reshape(-1, 1, 2)
-        dst_pts = np.float32([kp_stored[m.trainIdx].pt for m in best_candidate_matches]).reshape(-1, 1, 2)
+    def template_scores(self, live_pts, query_idx, train_idx, distances, top=1, min_votes=MIN_VOTES, snap=None):
+        """
+        Votes + geometric inliers of the best-voted templates for one probe.
+        live_pts: (N, 2) probe keypoints; the rest as from _candidate_matches().
+        Returns [(template, votes, inliers)], most votes first, for up to `top`
+        templates (None = all) with at least min_votes votes.
+        """
+        if len(train_idx) == 0: return []
+        snap = snap or self.snapshot
 
-        # Run Geometric Verification
-        M, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 10.0)
-        
-        if mask is not None:
-            inliers = np.sum(mask)
-            # Threshold: >25 inliers is usually a very strong match for SIFT
-            if inliers > 15: 
-                name = filename.replace(".npy", "")
-                return name, inliers
+        # Tally Votes: Which template owns these matched descriptors?
+        owners = np.searchsorted(snap.template_offsets, train_idx, side="right") - 1
+        votes = np.bincount(owners, minlength=len(snap.template_keys))
+        order = np.argsort(-votes, kind="stable")
+        if top is not None: order = order[:top]
 
-        return None, 0
+        scores = []
+        for t in order:
+            if votes[t] < min_votes: break
+            # Global indices address train_points directly;
+            # PROSAC orders by descriptor distance
+            sel = owners == t
+            inliers = self.geometry.verify(live_pts[query_idx[sel]], snap.train_points[train_idx[sel]], distances[sel])
+            scores.append((int(t), int(votes[t]), inliers))
+        return scores
 
     # def delete_specific_finger(self, username, finger_name):
     #     """Deletes a single finger and rebuilds the tree."""
@@ -244,21 +558,17 @@ class FingerprintMatcher:
         
     def get_enrolled_fingers(self, username):
         """Returns list of fingers for fprintd"""
-        fingers = []
-        prefix = f"{username}_"
-        for filename in os.listdir(self.enroll_dir):
-            if filename.startswith(prefix) and filename.endswith(".npy"):
-                fingers.append(filename[len(prefix):-4])
-        return fingers
+        return list_enrolled_fingers(self.enroll_dir, username)
 
     def delete_user_fingers(self, username):
         """Wipes all fingers for a user"""
         prefix = f"{username}_"
         deleted = False
-        for filename in os.listdir(self.enroll_dir):
-            if filename.startswith(prefix):
-                os.remove(os.path.join(self.enroll_dir, filename))
-                deleted = True
-        
-        if deleted:
-            self.rebuild_index()
\ No newline at end of file
+        with self._write_lock:
+            for filename in os.listdir(self.enroll_dir):
+                if filename.startswith(prefix):
+                    os.remove(os.path.join(self.enroll_dir, filename))
+                    deleted = True
+
+            if deleted:
+                self.rebuild_index()
\ No newline at end of file
@@ -0,0 +1,300 @@
+import atexit
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from .quality import QUALITY_THRESHOLD, frame_quality
+from .fingerprint_matcher import list_enrolled_fingers
+
+FRAME_SHAPE = (50, 103)
+# Index build + warm-up of a fresh worker (large stores take a while)
+STARTUP_TIMEOUT = 120.0
+# A verify / extract that takes longer than this means the worker is wedged
+REQUEST_TIMEOUT = 10.0
+# save / delete rebuild the whole index
+REBUILD_TIMEOUT = 120.0
+# Back-off between restarts of a worker that keeps dying
+MIN_RESTART_INTERVAL = 1.0
+MAX_RESTART_INTERVAL = 30.0
+
+def _warmup_frame(seed=0):
+    """Synthetic finger (smooth ridge field like bench_descriptors) that SIFT finds keypoints on"""
+    import cv2
+    rng = np.random.default_rng(seed)
+    h, w = FRAME_SHAPE
+    y, x = np.mgrid[0:2 * h, 0:2 * w].astype(np.float32)
+    field = cv2.GaussianBlur(rng.normal(0, 1, y.shape).astype(np.float32), (0, 0), 12)
+    theta = field / (np.abs(field).max() + 1e-6) * np.pi
+    phase = (x * np.cos(theta) + y * np.sin(theta)) * 2 * np.pi / 7.5
+    img = 128 + 60 * np.sin(phase + 4 * field) + rng.normal(0, 6, y.shape)
+    return np.clip(img[h // 2:h // 2 + h, w // 2:w // 2 + w], 0, 255).astype(np.uint8)
+
+def _warm_up(matcher):
+    """
+    First calls allocate SIFT pyramids / FLANN search state / RANSAC buffers
+    lazily; pay that now instead of on the user's first touch.
+    """
+    warm = _warmup_frame()
+    kp, _ = matcher.sift.detectAndCompute(matcher._preprocess(warm), None)
+    if len(kp) < 4:
+        print(f"[MATCHER] Warm-up frame gave only {len(kp)} keypoints, matching stays cold")
+    matcher.verify_finger(warm.tobytes(), check_quality=False)
+
+    # A stranger's frame may not collect enough votes for the geometric check;
+    # a stored template as probe always does
+    snap = matcher.snapshot
+    if snap.empty: return
+    end = snap.template_offsets[1]
+    q, t, d = matcher._candidate_matches(snap.index_view(snap.train_descriptors[:end]), snap)
+    matcher.template_scores(snap.train_points[:end], q, t, d, top=1, snap=snap)
+
+def _serve(conn, handle):
+    """Answers commands on one pipe until "stop" or the parent goes away"""
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        if msg[0] == "stop": break
+        try:
+            conn.send(("ok", handle(msg)))
+        except (BrokenPipeError, OSError):
+            break
+        except Exception as e:
+            conn.send(("error", repr(e)))
+
+def _matcher_worker(read_conn, write_conn, shm_name, matcher_args):
+    """
+    Worker process: owns the FingerprintMatcher (index, SIFT, RANSAC).
+    Frames arrive in the shared memory slot. Verify / extract come in on
+    read_conn (main thread); save / delete on write_conn (writer thread),
+    so a rebuild publishes its snapshot while verifies carry on with the old one.
+    """
+    from .fingerprint_matcher import FingerprintMatcher
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frame = np.ndarray(FRAME_SHAPE, dtype=np.uint8, buffer=shm.buf)
+    try:
+        matcher = FingerprintMatcher(**matcher_args)
+        _warm_up(matcher)
+
+        def write(msg):
+            if msg[0] == "save": return matcher.save_templates(msg[1], msg[2])
+            if msg[0] == "delete": return matcher.delete_user_fingers(msg[1])
+            raise ValueError(f"Unknown command {msg[0]}")
+
+        def read(msg):
+            if msg[0] == "verify": return matcher.verify_finger(frame.tobytes(), check_quality=msg[1])
+            if msg[0] == "extract": return matcher.extract_template(frame.tobytes())
+            if msg[0] == "corrector":
+                if matcher.corrector is not None:
+                    matcher.corrector.tables = msg[1]
+                return None
+            raise ValueError(f"Unknown command {msg[0]}")
+
+        threading.Thread(target=_serve, args=(write_conn, write), name="matcher-writer", daemon=True).start()
+        read_conn.send(("ready", None))
+        _serve(read_conn, read)
+    finally:
+        del frame
+        shm.close()
+        read_conn.close()
+        write_conn.close()
+
+class MatcherProcess:
+    """
+    FingerprintMatcher running in a supervised worker process, so SIFT /
+    FLANN / RANSAC and index rebuilds never hold the bridge's GIL (USB
+    capture timing and D-Bus dispatch stay on their own cadence).
+
+    Same methods as FingerprintMatcher as far as egis-bridge and
+    EnrollmentSession use it. The worker is warmed up before the
+    constructor returns and restarted (warm again) whenever it dies or
+    wedges; a request that hits a dead worker fails like a bad scan.
+    Correction tables rebuilt by the driver are forwarded automatically.
+    Template changes use their own channel and never queue behind verifies.
+    """
+    def __init__(self, enroll_dir="/var/lib/open-fprintd/egis", corrector=None, **matcher_kwargs):
+        self.enroll_dir = enroll_dir
+        self.corrector = corrector
+        self.matcher_args = dict(matcher_kwargs, enroll_dir=enroll_dir, corrector=corrector)
+        self.min_quality = QUALITY_THRESHOLD
+
+        # read_lock: one verify / extract in flight (owns the frame slot)
+        # write_lock: one save / delete in flight
+        # proc_lock: proc / conns / generation. Always taken last.
+        self.read_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.proc_lock = threading.Lock()
+        self.proc = None
+        self.conns = None
+        self.generation = 0
+        self.closed = False
+        self.restarts = 0
+        self._sent_tables = None
+        self._last_start = 0.0
+        self._backoff = MIN_RESTART_INTERVAL
+
+        self.shm = shared_memory.SharedMemory(create=True, size=FRAME_SHAPE[0] * FRAME_SHAPE[1])
+        self.frame = np.ndarray(FRAME_SHAPE, dtype=np.uint8, buffer=self.shm.buf)
+
+        with self.proc_lock:
+            self._start()
+        self.supervisor = threading.Thread(target=self._supervise, name="matcher-supervisor", daemon=True)
+        self.supervisor.start()
+        atexit.register(self.close)
+
+    # --- Process management (call with self.proc_lock held) ---
+
+    def _start(self):
+        # Don't spin on a worker that dies during startup
+        delay = self._last_start + self._backoff - time.time()
+        if delay > 0: time.sleep(delay)
+        self._last_start = time.time()
+
+        # spawn: never fork a process that holds GLib / USB threads.
+        # Not a daemon process: the matcher may start its own index shards.
+        ctx = mp.get_context("spawn")
+        read_conn, child_read = ctx.Pipe()
+        write_conn, child_write = ctx.Pipe()
+        if self.corrector is not None:
+            self._sent_tables = self.corrector.tables
+        proc = ctx.Process(target=_matcher_worker, args=(child_read, child_write, self.shm.name, self.matcher_args),
+                           name="egis-matcher")
+        proc.start()
+        child_read.close()
+        child_write.close()
+        self.proc, self.conns = proc, {"read": read_conn, "write": write_conn}
+        self.generation += 1
+
+        start_t = time.time()
+        try:
+            if not read_conn.poll(STARTUP_TIMEOUT):
+                raise TimeoutError("startup timed out")
+            read_conn.recv()
+        except (EOFError, OSError, TimeoutError) as e:
+            print(f"[MATCHER] Worker failed to start: {e}")
+            self._kill()
+            self._backoff = min(MAX_RESTART_INTERVAL, self._backoff * 2)
+            return False
+
+        self._backoff = MIN_RESTART_INTERVAL
+        print(f"[MATCHER] Worker {proc.pid} ready in {time.time()-start_t:.2f}s")
+        return True
+
+    def _kill(self):
+        proc, conns = self.proc, self.conns
+        self.proc = self.conns = None
+        for conn in (conns or {}).values():
+            try: conn.close()
+            except OSError: pass
+        if proc is not None:
+            proc.terminate()
+            proc.join(timeout=2.0)
+            if proc.is_alive(): proc.kill()
+
+    def _restart(self, reason):
+        print(f"[MATCHER] Restarting worker ({reason})")
+        self.restarts += 1
+        self._kill()
+        return self._start()
+
+    def _supervise(self):
+        """Restarts a crashed worker right away, so it's warm before the next touch."""
+        while not self.closed:
+            proc = self.proc
+            if proc is None:
+                time.sleep(self._backoff)
+            else:
+                wait([proc.sentinel], timeout=1.0)
+                if proc.is_alive(): continue
+            with self.proc_lock:
+                if self.closed or (self.proc is not None and self.proc.is_alive()): continue
+                code = self.proc.exitcode if self.proc is not None else None
+                self._restart(f"exited with {code}" if code is not None else "not running")
+
+    # --- Requests ---
+
+    def _request(self, channel, msg, frame=None, timeout=REQUEST_TIMEOUT):
+        """Returns (True, result) or (False, None) if the worker failed / crashed."""
+        with (self.read_lock if channel == "read" else self.write_lock):
+            with self.proc_lock:
+                if self.closed: return False, None
+                if self.proc is None or not self.proc.is_alive():
+                    if not self._restart("not running"): return False, None
+                generation, conn = self.generation, self.conns[channel]
+
+            try:
+                # Driver recalibrated since the worker last heard: forward the new tables
+                if channel == "read" and self.corrector is not None and self.corrector.tables is not self._sent_tables:
+                    tables = self.corrector.tables
+                    conn.send(("corrector", tables))
+                    if not conn.poll(REQUEST_TIMEOUT): raise TimeoutError("corrector update timed out")
+                    conn.recv()
+                    self._sent_tables = tables
+
+                if frame is not None:
+                    self.frame[:] = np.frombuffer(bytes(frame), dtype=np.uint8).reshape(FRAME_SHAPE)
+                conn.send(msg)
+                if not conn.poll(timeout): raise TimeoutError(f"{msg[0]} timed out")
+                status, result = conn.recv()
+            except (EOFError, OSError, TimeoutError) as e:
+                with self.proc_lock:
+                    # Whoever noticed first restarts; the other channel just fails its request
+                    if self.generation == generation and not self.closed:
+                        self._restart(repr(e))
+                return False, None
+
+        if status != "ok":
+            print(f"[MATCHER] Worker {msg[0]} failed: {result}")
+            return False, None
+        return True, result
+
+    def assess_quality(self, raw_frame):
+        """Cheap pre-SIFT quality score, computed locally"""
+        img_arr = np.frombuffer(bytes(raw_frame), dtype=np.uint8).reshape(FRAME_SHAPE)
+        return frame_quality(img_arr)
+
+    def verify_finger(self, raw_frame, check_quality=True):
+        ok, result = self._request("read", ("verify", check_quality), frame=raw_frame)
+        return tuple(result) if ok else (None, 0)
+
+    def extract_template(self, raw):
+        ok, result = self._request("read", ("extract",), frame=raw)
+        return result if ok else None
+
+    def save_templates(self, name, new_templates):
+        ok, result = self._request("write", ("save", name, list(new_templates)), timeout=REBUILD_TIMEOUT)
+        return bool(ok and result)
+
+    def enroll_finger(self, name, raw_frames):
+        new_templates = [t for t in (self.extract_template(raw) for raw in raw_frames) if t is not None]
+        return self.save_templates(name, new_templates)
+
+    def delete_user_fingers(self, username):
+        """Raises like the in-process matcher would, so the caller can report the failure"""
+        ok, _ = self._request("write", ("delete", username), timeout=REBUILD_TIMEOUT)
+        if not ok:
+            raise RuntimeError(f"Matcher worker failed to delete prints for {username}")
+
+    def get_enrolled_fingers(self, username):
+        """Straight from the store directory; no need to ask the worker"""
+        return list_enrolled_fingers(self.enroll_dir, username)
+
+    def close(self):
+        with self.read_lock, self.proc_lock:
+            if self.closed: return
+            self.closed = True
+            if self.conns is not None:
+                try: self.conns["read"].send(("stop",))
+                except (OSError, ValueError): pass
+            if self.proc is not None:
+                self.proc.join(timeout=2.0)
+            self._kill()
+            del self.frame
+            self.shm.close()
+            self.shm.unlink()
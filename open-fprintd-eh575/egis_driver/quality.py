@@ -0,0 +1,61 @@
+import numpy as np
+
+# Frames scoring below this never reach SIFT
+QUALITY_THRESHOLD = 0.30
+# Partial edge touches: less than this fraction of ridge-bearing blocks
+MIN_FOREGROUND = 0.25
+# Blurred noise has area and sharpness too; without oriented ridges it isn't a finger
+MIN_COHERENCE = 0.25
+# Mean gradient magnitude (grey levels / px) of a crisp ridge pattern
+SHARPNESS_REF = 8.0
+# Coherence of pure sensor noise over a 5x5 block; rescaled away
+COHERENCE_FLOOR = 0.3
+BLOCK_SIZE = 5
+
+def _block_sum(a, block):
+    """Sums non-overlapping block x block tiles (edges are cropped)."""
+    h = (a.shape[0] // block) * block
+    w = (a.shape[1] // block) * block
+    return a[:h, :w].reshape(h // block, block, w // block, block).sum(axis=(1, 3))
+
+def frame_quality(img_arr, block=BLOCK_SIZE):
+    """
+    Cheap quality score on the RAW frame, computed before any feature extraction.
+    Returns a dict with:
+      area      - fraction of blocks carrying ridge energy (smudges/edge touches are low)
+      coherence - mean ridge-orientation coherence over those blocks (smudges are low)
+      sharpness - ridge gradient strength (motion blur / light presses are low)
+      score     - geometric mean of the three, 0..1, capped by area / coherence
+                  when either is below its own minimum
+    """
+    img = np.asarray(img_arr, dtype=np.float32)
+    gy, gx = np.gradient(img)
+
+    # Block-wise structure tensor
+    gxx = _block_sum(gx * gx, block)
+    gyy = _block_sum(gy * gy, block)
+    gxy = _block_sum(gx * gy, block)
+    energy = gxx + gyy
+
+    # Foreground: blocks whose gradient energy is a meaningful share of the strongest ones
+    ref = np.percentile(energy, 90)
+    fg = energy > max(0.2 * ref, 1e-6)
+    area = float(fg.mean())
+    if not fg.any():
+        return {"score": 0.0, "area": 0.0, "coherence": 0.0, "sharpness": 0.0}
+
+    coh = np.sqrt((gxx - gyy) ** 2 + 4.0 * gxy ** 2) / np.maximum(energy, 1e-6)
+    coherence = float(np.average(coh[fg], weights=energy[fg]))
+    coherence = max(0.0, (coherence - COHERENCE_FLOOR) / (1.0 - COHERENCE_FLOOR))
+
+    # Only the oriented part of the gradient counts, so noise doesn't look sharp
+    grad_mag = np.sqrt(coh[fg] * energy[fg] / (block * block))
+    sharpness = float(min(1.0, grad_mag.mean() / SHARPNESS_REF))
+
+    score = (area * coherence * sharpness) ** (1.0 / 3.0)
+    if area < MIN_FOREGROUND:
+        score = min(score, area)
+    if coherence < MIN_COHERENCE:
+        score = min(score, coherence)
+
+    return {"score": float(score), "area": area, "coherence": coherence, "sharpness": sharpness}
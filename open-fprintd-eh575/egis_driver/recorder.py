@@ -0,0 +1,115 @@
+import os
+import struct
+import time
+
+import numpy as np
+
+# Container layout: 64-byte header followed by fixed-size records, so a
+# recording is append-only while capturing and np.memmap-able afterwards.
+# A crash can only ever leave a torn LAST record, which readers ignore.
+MAGIC = b"EGISREC1"
+VERSION = 1
+HEADER_FMT = "<8sIIII"
+HEADER_SIZE = 64
+LABEL_LEN = 32
+
+def record_dtype(height=50, width=103):
+    return np.dtype([
+        ("timestamp", "<f8"),    # time.time() at capture start
+        ("usb_time", "<f4"),     # seconds spent in rearm + trigger + read
+        ("contrast", "<f4"),
+        ("touched", "u1"),       # driver presence decision
+        ("touch_id", "<i4"),     # increments on every new touch, -1 while idle
+        ("user", f"S{LABEL_LEN}"),
+        ("finger", f"S{LABEL_LEN}"),
+        ("frame", "u1", (height, width)),
+    ])
+
+def _read_header(f):
+    raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE:
+        raise ValueError("Not an Egis recording (short header)")
+    magic, version, height, width, itemsize = struct.unpack_from(HEADER_FMT, raw)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not an Egis recording (bad magic/version)")
+    dtype = record_dtype(height, width)
+    if dtype.itemsize != itemsize:
+        raise ValueError("Recording record size does not match this version")
+    return dtype
+
+class FrameRecorder:
+    """
+    Appends raw frames + metadata to a recording.
+    Writes go through one buffered file handle; nothing is encoded per frame,
+    so capture runs at USB rate.
+    """
+    def __init__(self, path, height=50, width=103, user="", finger=""):
+        self.path = path
+        self.user = user
+        self.finger = finger
+        self.dtype = record_dtype(height, width)
+        self.count = 0
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                if _read_header(f) != self.dtype:
+                    raise ValueError(f"{path} was recorded with a different frame size")
+            size = os.path.getsize(path)
+            # Drop a torn record left by a crash before appending after it
+            self.count = (size - HEADER_SIZE) // self.dtype.itemsize
+            with open(path, "r+b") as f:
+                f.truncate(HEADER_SIZE + self.count * self.dtype.itemsize)
+            self.file = open(path, "ab")
+        else:
+            self.file = open(path, "wb")
+            header = struct.pack(HEADER_FMT, MAGIC, VERSION, height, width, self.dtype.itemsize)
+            self.file.write(header.ljust(HEADER_SIZE, b"\0"))
+
+        self._record = np.zeros(1, dtype=self.dtype)
+
+    def append(self, data, contrast, usb_time, touched, touch_id=-1, timestamp=None):
+        rec = self._record
+        rec["timestamp"] = time.time() if timestamp is None else timestamp
+        rec["usb_time"] = usb_time
+        rec["contrast"] = contrast
+        rec["touched"] = bool(touched)
+        rec["touch_id"] = touch_id
+        rec["user"] = self.user.encode()[:LABEL_LEN]
+        rec["finger"] = self.finger.encode()[:LABEL_LEN]
+        rec["frame"] = np.frombuffer(bytes(data), dtype=np.uint8).reshape(self.dtype["frame"].shape)
+        self.file.write(rec.tobytes())
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+def open_recording(path):
+    """Read-only structured memmap over every complete record."""
+    with open(path, "rb") as f:
+        dtype = _read_header(f)
+    count = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+def export_png(path, out_dir, touched_only=False):
+    """Writes recorded frames as normalized PNGs (same look as debug_sensor.py). Returns the count."""
+    import cv2
+
+    records = open_recording(path)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    written = 0
+    for i, rec in enumerate(records):
+        if touched_only and not rec["touched"]: continue
+        img = cv2.normalize(np.asarray(rec["frame"]), None, 0, 255, cv2.NORM_MINMAX)
+        label = "_".join(x for x in (rec["user"].decode(), rec["finger"].decode()) if x)
+        name = f"{i:06d}_{label + '_' if label else ''}touch{rec['touch_id']}_contrast_{rec['contrast']:.1f}.png"
+        cv2.imwrite(os.path.join(out_dir, name), img)
+        written += 1
+    return written
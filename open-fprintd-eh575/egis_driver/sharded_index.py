@@ -0,0 +1,180 @@
+import atexit
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Same FLANN settings as the in-process index in fingerprint_matcher.py
+INDEX_PARAMS = dict(algorithm=1, trees=5)
+SEARCH_PARAMS = dict(checks=50)
+
+def _shard_worker(query_conn, control_conn):
+    """
+    Worker process: owns the FLANN index of one contiguous slice of the
+    global descriptor matrix, per generation, and answers knn queries with
+    GLOBAL indices. Builds / drops come in on control_conn (own thread), so
+    queries against the current generation carry on while the next one builds.
+    """
+    import cv2
+
+    # generation -> (shared memory, slice view, cv2.flann_Index, global offset)
+    indexes = {}
+
+    def control():
+        while True:
+            try:
+                msg = control_conn.recv()
+            except (EOFError, OSError):
+                break
+            if msg[0] == "build":
+                _, gen, shm_name, shape, start, end = msg
+                # flann_Index keeps a reference to the data instead of a copy:
+                # the tree is built straight over the shared memory slice,
+                # which stays mapped for as long as the generation lives
+                shm = shared_memory.SharedMemory(name=shm_name)
+                view = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)[start:end]
+                index = cv2.flann_Index(view, INDEX_PARAMS) if end > start else None
+                indexes[gen] = (shm, view, index, start)
+                control_conn.send(True)
+            elif msg[0] == "drop" and msg[1] in indexes:
+                # The tree and the view go before the mapping they point into
+                shm, view, index, _ = indexes.pop(msg[1])
+                del index, view
+                shm.close()
+
+    threading.Thread(target=control, name="shard-control", daemon=True).start()
+
+    while True:
+        try:
+            msg = query_conn.recv()
+        except (EOFError, OSError):
+            break
+        if msg[0] == "stop": break
+
+        _, gen, des, k = msg
+        nq = len(des)
+        idx = np.full((nq, k), -1, dtype=np.int64)
+        dist = np.full((nq, k), np.inf, dtype=np.float32)
+        _, view, index, offset = indexes.get(gen, (None, None, None, 0))
+        if index is not None and nq:
+            kk = min(k, len(view))
+            found, sq = index.knnSearch(des, kk, params=SEARCH_PARAMS)
+            idx[:, :kk] = found.reshape(nq, kk) + offset
+            # KD-tree reports squared L2; FlannBasedMatcher reports L2
+            dist[:, :kk] = np.sqrt(np.maximum(sq.reshape(nq, kk), 0))
+        query_conn.send((idx, dist))
+
+class ShardedIndex:
+    """
+    FLANN index partitioned across N long-lived worker processes.
+    Queries fan out to every shard in parallel (outside our GIL) and the
+    per-shard top-k lists are merged back into one global top-k.
+
+    Every build() is a new generation held next to the older ones in the
+    same workers, so a matcher snapshot keeps querying its own generation
+    while the next one is built; it drops it once it is no longer used.
+    """
+    def __init__(self, num_shards):
+        self.num_shards = max(1, int(num_shards))
+        self.query_lock = threading.Lock()
+        self.control_lock = threading.Lock()
+        self.workers = []
+        self.generation = 0
+        self._start_workers()
+        atexit.register(self.close)
+
+    def _start_workers(self):
+        # spawn: never fork a process that holds GLib / USB threads
+        ctx = mp.get_context("spawn")
+        for _ in range(self.num_shards):
+            query_conn, child_query = ctx.Pipe()
+            control_conn, child_control = ctx.Pipe()
+            proc = ctx.Process(target=_shard_worker, args=(child_query, child_control), daemon=True)
+            proc.start()
+            child_query.close()
+            child_control.close()
+            self.workers.append((proc, query_conn, control_conn))
+
+    def build(self, train_descriptors):
+        """
+        Publishes the descriptor matrix through shared memory and builds a new
+        generation on every shard. Returns a ShardView for querying it.
+        """
+        start_t = time.time()
+        train = np.ascontiguousarray(train_descriptors, dtype=np.float32)
+        bounds = np.linspace(0, len(train), self.num_shards + 1).astype(int)
+
+        # The segment is the only copy the shards use; unlinking the name once
+        # they are attached frees it as soon as the last one drops the generation
+        shm = shared_memory.SharedMemory(create=True, size=max(1, train.nbytes))
+        try:
+            np.ndarray(train.shape, dtype=np.float32, buffer=shm.buf)[:] = train
+            with self.control_lock:
+                self.generation += 1
+                gen = self.generation
+                for i, (_, _, conn) in enumerate(self.workers):
+                    conn.send(("build", gen, shm.name, train.shape, int(bounds[i]), int(bounds[i + 1])))
+                for _, _, conn in self.workers:
+                    conn.recv()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        print(f"[MATCHER] Sharded index built in {time.time()-start_t:.2f}s "
+              f"({self.num_shards} shards, {len(train)} features, generation {gen})")
+        return ShardView(self, gen, len(train))
+
+    def knn_arrays(self, des, k, gen):
+        """(idx, dist) (N, k) arrays, global indices, ascending distance; -1 / inf where fewer than k."""
+        des = np.ascontiguousarray(des, dtype=np.float32)
+        with self.query_lock:
+            for _, conn, _ in self.workers:
+                conn.send(("query", gen, des, k))
+            results = [conn.recv() for _, conn, _ in self.workers]
+
+        idx = np.concatenate([r[0] for r in results], axis=1)
+        dist = np.concatenate([r[1] for r in results], axis=1)
+        order = np.argsort(dist, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(idx, order, axis=1), np.take_along_axis(dist, order, axis=1)
+
+    def drop(self, gen):
+        with self.control_lock:
+            for _, _, conn in self.workers:
+                try: conn.send(("drop", gen))
+                except (OSError, ValueError): pass
+
+    def close(self):
+        atexit.unregister(self.close)
+        with self.query_lock, self.control_lock:
+            for proc, query_conn, control_conn in self.workers:
+                try: query_conn.send(("stop",))
+                except (OSError, ValueError): pass
+            for proc, query_conn, control_conn in self.workers:
+                proc.join(timeout=1.0)
+                if proc.is_alive(): proc.terminate()
+                query_conn.close()
+                control_conn.close()
+            self.workers = []
+
+class ShardView:
+    """One generation of a ShardedIndex; close() drops it from the shards."""
+    def __init__(self, index, gen, size):
+        self.index = index
+        self.gen = gen
+        self.size = size
+
+    def knn_arrays(self, des, k=2):
+        return self.index.knn_arrays(des, k, self.gen)
+
+    def knnMatch(self, des, k=2):
+        """Drop-in for FlannBasedMatcher.knnMatch: returns lists of cv2.DMatch with global trainIdx."""
+        import cv2
+
+        idx, dist = self.knn_arrays(des, k)
+        return [[cv2.DMatch(q, int(idx[q, j]), 0, float(dist[q, j])) for j in range(k) if idx[q, j] >= 0]
+                for q in range(len(idx))]
+
+    def close(self):
+        self.index.drop(self.gen)
@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+
+# VLAD codebook size: signature is VLAD_WORDS x descriptor dims
+VLAD_WORDS = 16
+# Fingers (enrolled files) whose templates survive the coarse stage
+SHORTLIST = 4
+# Neighbours fetched per descriptor when only the shortlist counts: enough that
+# most rows still hold two shortlisted ones
+SHORTLIST_KNN = 8
+# Descriptors sampled from the store for k-means
+CODEBOOK_MAX_SAMPLES = 20000
+
+class GlobalSignature:
+    """
+    Compact per-template VLAD vector over the SIFT descriptors.
+    Comparing a live frame against every template is then one matrix-vector
+    product, used to shortlist candidates before knnMatch + RANSAC.
+    """
+    def __init__(self, words=VLAD_WORDS):
+        self.words = words
+        self.codebook = None
+
+    @property
+    def fitted(self):
+        return self.codebook is not None
+
+    def fit(self, des, max_samples=CODEBOOK_MAX_SAMPLES, seed=0):
+        data = np.asarray(des, dtype=np.float32)
+        if len(data) > max_samples:
+            rows = np.random.default_rng(seed).choice(len(data), max_samples, replace=False)
+            data = data[rows]
+        k = min(self.words, len(data))
+
+        cv2.setRNGSeed(seed)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1e-3)
+        _, _, centers = cv2.kmeans(data, k, None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+        self.codebook = centers.astype(np.float32)
+        return self
+
+    def compute(self, des):
+        """VLAD with power + intra + L2 normalization -> 1-D float32"""
+        des = np.asarray(des, dtype=np.float32)
+        k, d = self.codebook.shape
+
+        # Nearest codeword for every descriptor (squared L2, expanded form)
+        dists = (des * des).sum(axis=1, keepdims=True) - 2.0 * des @ self.codebook.T \
+                + (self.codebook * self.codebook).sum(axis=1)
+        assign = np.argmin(dists, axis=1)
+
+        vlad = np.zeros((k, d), dtype=np.float32)
+        np.add.at(vlad, assign, des - self.codebook[assign])
+
+        vlad = np.sign(vlad) * np.sqrt(np.abs(vlad))
+        norms = np.linalg.norm(vlad, axis=1, keepdims=True)
+        vlad /= np.maximum(norms, 1e-12)
+        vlad = vlad.ravel()
+        return vlad / max(float(np.linalg.norm(vlad)), 1e-12)
@@ -3,8 +3,10 @@ import dbus.service
 import logging
 import pwd
 import threading
+import time
 from gi.repository import GLib
 import openfprintd.polkit as polkit
+import openfprintd.tracing as tracing
 
 INTERFACE_NAME = 'net.reactivated.Fprint.Device'
 ENROLL_STAGES = 15
@@ -44,27 +46,39 @@ class Device(dbus.service.Object):
         self.busy = False
         self.suspended = False
         self.callbacks = []
+        # Correlation id of the current verify/enroll (see tracing.py)
+        self.trace_id = None
+        self.bridge_tracing = True
 
     # --- Helper: Async Auth Wrapper ---
-    def _run_with_auth(self, sender, action, success_cb, error_cb, operation_cb):
+    def _run_with_auth(self, sender, action, success_cb, error_cb, operation_cb, trace_id=None):
         """
         Runs the Polkit check in a thread to avoid blocking the main loop.
         If successful, executes operation_cb() on the main thread.
         """
+        queued = time.time()
+
         def auth_thread():
+            started = time.time()
+            tracing.record(trace_id, 'queue', queued, started)
             try:
                 # This blocks, but now it's in a thread so the daemon stays alive
                 polkit.check_privilege(sender, action)
+                authed = time.time()
+                tracing.record(trace_id, 'auth', started, authed)
                 # Success! Schedule the actual work on the main loop
-                GLib.idle_add(run_op)
+                GLib.idle_add(run_op, authed)
             except Exception:
+                tracing.record(trace_id, 'auth', started, time.time(), denied=True)
                 # Map all auth failures to PermissionDenied
                 GLib.idle_add(error_cb, PermissionDenied())
 
-        def run_op():
+        def run_op(authed):
+            tracing.record(trace_id, 'dispatch', authed, time.time())
             try:
                 # Execute the actual DBus target call
-                result = operation_cb()
+                with tracing.span(trace_id, 'bridge-call'):
+                    result = operation_cb()
                 # If the target returned a value, pass it back, else just None
                 if result is not None:
                     success_cb(result)
@@ -85,6 +99,15 @@ class Device(dbus.service.Object):
         else:
             cb()
 
+    def _send_trace_id(self, trace_id):
+        # Fire-and-forget; D-Bus keeps ordering, so it lands before the call that follows
+        if not self.bridge_tracing: return
+        def unsupported(e):
+            logging.debug('Bridge does not support tracing: %s' % repr(e))
+            self.bridge_tracing = False
+        self.target.SetTraceId(trace_id, signature='s',
+                               reply_handler=lambda: None, error_handler=unsupported)
+
     def call_cbs(self):
         for cb in self.callbacks:
             try: cb()
@@ -95,6 +118,7 @@ class Device(dbus.service.Object):
     def set_target(self, target_name, sender):
         self.target = self.bus.get_object(sender, target_name, introspect=False)
         self.target = dbus.Interface(self.target, 'io.github.uunicorn.Fprint.Device')
+        self.bridge_tracing = True
         self.target.connect_to_signal('VerifyStatus', self.VerifyStatus)
         self.target.connect_to_signal('VerifyFingerSelected', self.VerifyFingerSelected)
         self.target.connect_to_signal('EnrollStatus', self.EnrollStatus)
@@ -277,14 +301,18 @@ class Device(dbus.service.Object):
                          async_callbacks=('success_cb', 'error_cb'))
     def VerifyStart(self, finger_name, sender, connection, success_cb, error_cb):
         logging.debug('VerifyStart requested')
+        trace_id = tracing.new_trace_id()
+        tracing.record(trace_id, 'VerifyStart', time.time(), sender=sender, finger=finger_name)
         
         def op():
             if self.owner_watcher is None or self.claim_sender != sender:
                 raise ClaimDevice()
             self.busy = True
+            self.trace_id = trace_id
+            self._send_trace_id(trace_id)
             return self.target.VerifyStart(self.claimed_by, finger_name, signature='ss')
 
-        self._run_with_auth(sender, "net.reactivated.fprint.device.verify", success_cb, error_cb, op)
+        self._run_with_auth(sender, "net.reactivated.fprint.device.verify", success_cb, error_cb, op, trace_id)
 
     @dbus.service.method(dbus_interface=INTERFACE_NAME,
                          in_signature='', 
@@ -295,6 +323,7 @@ class Device(dbus.service.Object):
         logging.debug('VerifyStop')
         if self.owner_watcher is None or self.claim_sender != sender:
             raise ClaimDevice()
+        tracing.record(self.trace_id, 'VerifyStop', time.time())
         self.busy = False
         self.target.Cancel(signature='')
 
@@ -303,6 +332,7 @@ class Device(dbus.service.Object):
 
     @dbus.service.signal(dbus_interface=INTERFACE_NAME, signature='sb')
     def VerifyStatus(self, result, done):
+        tracing.record(self.trace_id, 'VerifyStatus', time.time(), result=result, done=bool(done))
         if done: self.busy = False
 
     # ------------------ Enroll --------------------------
@@ -315,14 +345,18 @@ class Device(dbus.service.Object):
                          async_callbacks=('success_cb', 'error_cb'))
     def EnrollStart(self, finger_name, sender, connection, success_cb, error_cb):
         logging.debug('EnrollStart requested')
+        trace_id = tracing.new_trace_id()
+        tracing.record(trace_id, 'EnrollStart', time.time(), sender=sender, finger=finger_name)
 
         def op():
             if self.owner_watcher is None or self.claim_sender != sender:
                 raise ClaimDevice()
             self.busy = True
+            self.trace_id = trace_id
+            self._send_trace_id(trace_id)
             return self.target.EnrollStart(self.claimed_by, finger_name, signature='ss')
 
-        self._run_with_auth(sender, "net.reactivated.fprint.device.enroll", success_cb, error_cb, op)
+        self._run_with_auth(sender, "net.reactivated.fprint.device.enroll", success_cb, error_cb, op, trace_id)
 
     @dbus.service.method(dbus_interface=INTERFACE_NAME,
                          in_signature='', 
@@ -333,11 +367,13 @@ class Device(dbus.service.Object):
         logging.debug('EnrollStop')
         if self.owner_watcher is None or self.claim_sender != sender:
             raise ClaimDevice()
+        tracing.record(self.trace_id, 'EnrollStop', time.time())
         self.busy = False
         self.target.Cancel(signature='')
 
     @dbus.service.signal(dbus_interface=INTERFACE_NAME, signature='sb')
     def EnrollStatus(self, result, done):
+        tracing.record(self.trace_id, 'EnrollStatus', time.time(), result=result, done=bool(done))
         if done: self.busy = False
 
     # ------------------ Debug --------------------------
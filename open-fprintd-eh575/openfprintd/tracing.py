@@ -0,0 +1,95 @@
+# openfprintd/tracing.py
+"""
+Lightweight span tracing shared by open-fprintd and egis-bridge.
+
+Every verify/enroll request gets a trace id in open-fprintd, which is handed
+to the bridge (SetTraceId) before the call itself. Both processes append
+their spans as JSON lines to <trace_dir>/<process>.jsonl; the file is rotated
+to .1 when full, so disk usage stays bounded like a ring buffer.
+Dump with: fprint-trace
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+TRACE_DIR = "/run/open-fprintd"
+# Spans per file before rotating to <file>.1
+MAX_SPANS = 5000
+
+_tracer = None
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+class Tracer:
+    def __init__(self, process, directory=TRACE_DIR, max_spans=MAX_SPANS):
+        self.process = process
+        self.path = os.path.join(directory, f"{process}.jsonl")
+        self.max_spans = max_spans
+        self.lock = threading.Lock()
+        self.count = 0
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                self.count = sum(1 for _ in f)
+        self.file = open(self.path, "a", buffering=1)
+
+    def record(self, trace_id, name, start, end=None, **attrs):
+        span = {"trace": trace_id, "proc": self.process, "name": name,
+                "start": start, "end": start if end is None else end,
+                "thread": threading.current_thread().name}
+        if attrs: span["attrs"] = attrs
+        line = json.dumps(span, default=str)
+
+        with self.lock:
+            if self.count >= self.max_spans:
+                self.file.close()
+                os.replace(self.path, self.path + ".1")
+                self.file = open(self.path, "a", buffering=1)
+                self.count = 0
+            self.file.write(line + "\n")
+            self.count += 1
+
+def configure(process, directory=TRACE_DIR):
+    """Enables tracing for this process. Failures only disable tracing."""
+    global _tracer
+    try:
+        _tracer = Tracer(process, directory)
+        logging.debug(f"Tracing to {_tracer.path}")
+    except OSError as e:
+        logging.warning(f"Tracing disabled: {e}")
+        _tracer = None
+
+def record(trace_id, name, start, end=None, **attrs):
+    """Records a span (or an instant event if end is None). No-op when tracing is off."""
+    if _tracer is None or trace_id is None: return
+    try:
+        _tracer.record(trace_id, name, start, end, **attrs)
+    except Exception as e:
+        logging.debug(f"Trace write failed: {e}")
+
+@contextmanager
+def span(trace_id, name, **attrs):
+    start = time.time()
+    try:
+        yield attrs
+    finally:
+        record(trace_id, name, start, time.time(), **attrs)
+
+def load(directory=TRACE_DIR):
+    """All spans from every process in directory, oldest file first."""
+    spans = []
+    if not os.path.isdir(directory): return spans
+    names = sorted(os.listdir(directory), key=lambda n: (not n.endswith(".1"), n))
+    for name in names:
+        if not (name.endswith(".jsonl") or name.endswith(".jsonl.1")): continue
+        with open(os.path.join(directory, name)) as f:
+            for line in f:
+                try: spans.append(json.loads(line))
+                except ValueError: pass  # torn line from a crash
+    return spans
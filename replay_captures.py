@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+"""
+Replays the image frames of USB captures (wireshark/*.pcapng) through the
+touch detector and checks that empty and finger frames stay apart.
+
+The baseline is calibrated on the leading empty frames of one capture and
+every frame of every capture is scored against it, so a second sensor
+session (re-init, different temperature) is covered too. Frames are labelled
+by the driver's legacy contrast check. Exits 1 if any frame is misjudged.
+
+    python3 replay_captures.py
+    python3 replay_captures.py wireshark/egis0575_1.txt.pcapng wireshark/egis0575_2.txt.pcapng
+"""
+import argparse
+import glob
+import os
+import struct
+import sys
+
+import numpy as np
+
+from egis_driver.background import BackgroundModel
+
+FRAME_SHAPE = (50, 103)
+# Same as EgisDriver.touch_threshold: contrast that means a finger is down
+TOUCH_CONTRAST = 31.0
+# Size of the sensor's image read in these captures; other large reads
+# (e.g. the 5356-byte one at the start of egis0575_1) aren't images
+CAPTURE_FRAME_BYTES = 5120
+
+def pcapng_packets(path):
+    """Raw packet data of every Enhanced Packet Block"""
+    with open(path, "rb") as f:
+        data = f.read()
+    off, endian = 0, "<"
+    while off + 8 <= len(data):
+        block_type, = struct.unpack_from(endian + "I", data, off)
+        if block_type == 0x0A0D0D0A:
+            # Section header: its byte-order magic decides the endianness
+            magic, = struct.unpack_from("<I", data, off + 8)
+            endian = "<" if magic == 0x1A2B3C4D else ">"
+        block_len, = struct.unpack_from(endian + "I", data, off + 4)
+        if block_type == 6:
+            cap_len, = struct.unpack_from(endian + "I", data, off + 20)
+            yield data[off + 28:off + 28 + cap_len]
+        off += block_len
+
+def capture_frames(path):
+    """(H, W) uint8 frames, padded / cut like EgisDriver.get_live_frame"""
+    target = FRAME_SHAPE[0] * FRAME_SHAPE[1]
+    frames = []
+    for packet in pcapng_packets(path):
+        # USBPcap header length is the first field
+        header_len, = struct.unpack_from("<H", packet, 0)
+        payload = packet[header_len:]
+        if len(payload) != CAPTURE_FRAME_BYTES: continue
+        payload = payload[:target] + bytes(max(0, target - len(payload)))
+        frames.append(np.frombuffer(payload, dtype=np.uint8).reshape(FRAME_SHAPE))
+    return frames
+
+def main():
+    default = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "wireshark", "*.pcapng")))
+    parser = argparse.ArgumentParser("Touch detector replay over USB captures")
+    parser.add_argument("captures", nargs="*", default=default, help="USBPcap captures (pcapng)")
+    parser.add_argument("--calibration-frames", type=int, default=5, help="Leading empty frames to calibrate on")
+    args = parser.parse_args()
+
+    captures = {os.path.basename(p): capture_frames(p) for p in args.captures}
+    failures = 0
+    for calib_name, calib_frames in captures.items():
+        empties = [f for f in calib_frames if f.std() < TOUCH_CONTRAST][:args.calibration_frames]
+        if not empties:
+            print(f"{calib_name}: no empty frames to calibrate on")
+            continue
+        model = BackgroundModel(FRAME_SHAPE)
+        model.calibrate(empties)
+        print(f"Calibrated on {calib_name} ({len(empties)} frames), threshold {model.threshold:.2f}")
+
+        for name, frames in captures.items():
+            scores = np.array([model.score(f) for f in frames])
+            touched = np.array([f.std() >= TOUCH_CONTRAST for f in frames])
+            wrong = np.flatnonzero((scores >= model.threshold) != touched)
+            failures += len(wrong)
+            empty_max = scores[~touched].max() if (~touched).any() else float("nan")
+            finger_min = scores[touched].min() if touched.any() else float("nan")
+            print(f"  {name}: {len(frames)} frames, empty max {empty_max:.2f}, finger min {finger_min:.2f}"
+                  + (f", misjudged {wrong.tolist()}" if len(wrong) else ""))
+
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())